@@ -9,7 +9,7 @@ from src.database import Base
 from src.models.user import User
 from src.models.email_account import EmailAccount
 from src.models.thread import Thread
-from src.models.message import Message, Attachment
+from src.models.message import Message, MessageBody, Attachment
 from src.config import settings
 
 # Alembic Config object
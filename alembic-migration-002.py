@@ -0,0 +1,30 @@
+"""inbox keyset pagination indexes
+
+Revision ID: 002
+Revises: 001
+Create Date: 2024-02-01 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers
+revision = '002'
+down_revision = '001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Newest-first scans per account and per thread without a sort node
+    op.create_index('ix_threads_account_last_msg', 'threads', ['account_id', sa.text('last_message_at DESC')], unique=False)
+    op.create_index('ix_messages_thread_date', 'messages', ['thread_id', sa.text('date DESC')], unique=False)
+
+    # Superseded by ix_messages_thread_date
+    op.drop_index(op.f('ix_messages_date'), table_name='messages')
+
+
+def downgrade() -> None:
+    op.create_index(op.f('ix_messages_date'), 'messages', ['date'], unique=False)
+    op.drop_index('ix_messages_thread_date', table_name='messages')
+    op.drop_index('ix_threads_account_last_msg', table_name='threads')
@@ -0,0 +1,28 @@
+"""unique email account per user and provider
+
+Revision ID: 003
+Revises: 002
+Create Date: 2024-02-08 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers
+revision = '003'
+down_revision = '002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Conflict target for the OAuth callback upsert
+    op.create_unique_constraint(
+        'uq_email_accounts_user_email_provider',
+        'email_accounts',
+        ['user_id', 'email_address', 'provider']
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint('uq_email_accounts_user_email_provider', 'email_accounts', type_='unique')
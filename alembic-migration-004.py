@@ -0,0 +1,36 @@
+"""drop redundant primary key indexes
+
+Revision ID: 004
+Revises: 003
+Create Date: 2024-02-15 00:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers
+revision = '004'
+down_revision = '003'
+branch_labels = None
+depends_on = None
+
+# Primary keys already get a unique btree; these duplicated it on every insert
+REDUNDANT_INDEXES = [
+    ('ix_users_id', 'users'),
+    ('ix_email_accounts_id', 'email_accounts'),
+    ('ix_threads_id', 'threads'),
+    ('ix_messages_id', 'messages'),
+    ('ix_attachments_id', 'attachments'),
+]
+
+
+def upgrade() -> None:
+    # CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        for index_name, _ in REDUNDANT_INDEXES:
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {index_name}')
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for index_name, table_name in REDUNDANT_INDEXES:
+            op.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON {table_name} (id)')
@@ -0,0 +1,70 @@
+"""denormalize inbox columns onto messages
+
+Revision ID: 005
+Revises: 004
+Create Date: 2024-02-22 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers
+revision = '005'
+down_revision = '004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('messages', sa.Column('account_id', sa.Integer(), nullable=True))
+    op.add_column('messages', sa.Column('account_email', sa.String(), nullable=True))
+    op.add_column('messages', sa.Column('provider', postgresql.ENUM('gmail', 'outlook', name='emailprovider', create_type=False), nullable=True))
+    op.add_column('messages', sa.Column('thread_snippet', sa.Text(), nullable=True))
+
+    # Backfill from the thread and account each message belongs to
+    op.execute("""
+        UPDATE messages m
+        SET account_id = t.account_id,
+            account_email = a.email_address,
+            provider = a.provider,
+            thread_snippet = t.snippet
+        FROM threads t
+        JOIN email_accounts a ON a.id = t.account_id
+        WHERE m.thread_id = t.id
+    """)
+
+    op.alter_column('messages', 'account_id', nullable=False)
+    op.create_foreign_key(
+        'fk_messages_account_id', 'messages', 'email_accounts',
+        ['account_id'], ['id'], ondelete='CASCADE'
+    )
+    op.create_index('ix_messages_account_date', 'messages', ['account_id', sa.text('date DESC')], unique=False)
+
+    # Keep messages.thread_snippet in step with threads.snippet
+    op.execute("""
+        CREATE FUNCTION propagate_thread_snippet() RETURNS trigger AS $$
+        BEGIN
+            UPDATE messages SET thread_snippet = NEW.snippet WHERE thread_id = NEW.id;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER trg_threads_snippet
+        AFTER UPDATE OF snippet ON threads
+        FOR EACH ROW
+        WHEN (OLD.snippet IS DISTINCT FROM NEW.snippet)
+        EXECUTE FUNCTION propagate_thread_snippet()
+    """)
+
+
+def downgrade() -> None:
+    op.execute('DROP TRIGGER IF EXISTS trg_threads_snippet ON threads')
+    op.execute('DROP FUNCTION IF EXISTS propagate_thread_snippet()')
+    op.drop_index('ix_messages_account_date', table_name='messages')
+    op.drop_constraint('fk_messages_account_id', 'messages', type_='foreignkey')
+    op.drop_column('messages', 'thread_snippet')
+    op.drop_column('messages', 'provider')
+    op.drop_column('messages', 'account_email')
+    op.drop_column('messages', 'account_id')
@@ -0,0 +1,31 @@
+"""partial index for active account sync fan-out
+
+Revision ID: 006
+Revises: 005
+Create Date: 2024-03-01 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers
+revision = '006'
+down_revision = '005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Serves the beat query (active accounts, least recently synced first) as an index-only scan
+    op.create_index(
+        'ix_email_accounts_active',
+        'email_accounts',
+        [sa.text('last_synced_at NULLS FIRST')],
+        unique=False,
+        postgresql_include=['id'],
+        postgresql_where=sa.text('is_active = true')
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_email_accounts_active', table_name='email_accounts')
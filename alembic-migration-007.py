@@ -0,0 +1,52 @@
+"""store address lists and sync state as jsonb
+
+Revision ID: 007
+Revises: 006
+Create Date: 2024-03-08 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers
+revision = '007'
+down_revision = '006'
+branch_labels = None
+depends_on = None
+
+JSONB_COLUMNS = [
+    ('messages', 'to_addrs'),
+    ('messages', 'cc_addrs'),
+    ('messages', 'bcc_addrs'),
+    ('email_accounts', 'sync_state'),
+]
+
+
+def upgrade() -> None:
+    for table_name, column_name in JSONB_COLUMNS:
+        op.alter_column(
+            table_name, column_name,
+            type_=postgresql.JSONB(),
+            existing_type=postgresql.JSON(astext_type=sa.Text()),
+            postgresql_using=f'{column_name}::jsonb'
+        )
+
+    # Containment lookups, e.g. to_addrs @> '["someone@example.com"]'
+    op.create_index('ix_messages_to_addrs_gin', 'messages', ['to_addrs'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'to_addrs': 'jsonb_path_ops'})
+    op.create_index('ix_messages_cc_addrs_gin', 'messages', ['cc_addrs'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'cc_addrs': 'jsonb_path_ops'})
+
+
+def downgrade() -> None:
+    op.drop_index('ix_messages_cc_addrs_gin', table_name='messages')
+    op.drop_index('ix_messages_to_addrs_gin', table_name='messages')
+
+    for table_name, column_name in JSONB_COLUMNS:
+        op.alter_column(
+            table_name, column_name,
+            type_=postgresql.JSON(astext_type=sa.Text()),
+            existing_type=postgresql.JSONB(),
+            postgresql_using=f'{column_name}::json'
+        )
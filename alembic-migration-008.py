@@ -0,0 +1,52 @@
+"""move message bodies to message_bodies
+
+Revision ID: 008
+Revises: 007
+Create Date: 2024-03-15 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers
+revision = '008'
+down_revision = '007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Wide, rarely read columns move out so messages rows stay narrow
+    op.create_table(
+        'message_bodies',
+        sa.Column('message_id', sa.Integer(), nullable=False),
+        sa.Column('body_text', sa.Text(), nullable=True),
+        sa.Column('body_html', sa.Text(), nullable=True),
+        sa.ForeignKeyConstraint(['message_id'], ['messages.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('message_id')
+    )
+    # Out-of-line, uncompressed TOAST so large HTML bodies can be streamed
+    op.execute('ALTER TABLE message_bodies ALTER COLUMN body_html SET STORAGE EXTERNAL')
+
+    op.execute("""
+        INSERT INTO message_bodies (message_id, body_text, body_html)
+        SELECT id, body_text, body_html FROM messages
+    """)
+
+    op.drop_column('messages', 'body_html')
+    op.drop_column('messages', 'body_text')
+
+
+def downgrade() -> None:
+    op.add_column('messages', sa.Column('body_text', sa.Text(), nullable=True))
+    op.add_column('messages', sa.Column('body_html', sa.Text(), nullable=True))
+
+    op.execute("""
+        UPDATE messages m
+        SET body_text = b.body_text,
+            body_html = b.body_html
+        FROM message_bodies b
+        WHERE b.message_id = m.id
+    """)
+
+    op.drop_table('message_bodies')
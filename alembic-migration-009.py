@@ -0,0 +1,34 @@
+"""drop single-column indexes covered by compound indexes
+
+Revision ID: 009
+Revises: 008
+Create Date: 2024-03-22 00:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers
+revision = '009'
+down_revision = '008'
+branch_labels = None
+depends_on = None
+
+# Each is the leading column (or sort key) of a compound index from 002
+REDUNDANT_INDEXES = [
+    ('ix_threads_account_id', 'threads', 'account_id'),
+    ('ix_threads_last_message_at', 'threads', 'last_message_at'),
+    ('ix_messages_thread_id', 'messages', 'thread_id'),
+]
+
+
+def upgrade() -> None:
+    # CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        for index_name, _, _ in REDUNDANT_INDEXES:
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {index_name}')
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for index_name, table_name, column_name in REDUNDANT_INDEXES:
+            op.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON {table_name} ({column_name})')
@@ -0,0 +1,59 @@
+"""store address lists as text arrays
+
+Revision ID: 010
+Revises: 009
+Create Date: 2024-03-29 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers
+revision = '010'
+down_revision = '009'
+branch_labels = None
+depends_on = None
+
+ADDRESS_COLUMNS = ['to_addrs', 'cc_addrs', 'bcc_addrs']
+
+
+def upgrade() -> None:
+    op.drop_index('ix_messages_cc_addrs_gin', table_name='messages')
+    op.drop_index('ix_messages_to_addrs_gin', table_name='messages')
+
+    # ALTER ... USING cannot contain a subquery, so convert through new columns
+    for column_name in ADDRESS_COLUMNS:
+        op.add_column('messages', sa.Column(f'{column_name}_new', postgresql.ARRAY(sa.String()), nullable=True))
+    op.execute(
+        'UPDATE messages SET '
+        + ', '.join(
+            f'{c}_new = ARRAY(SELECT jsonb_array_elements_text({c}))'
+            for c in ADDRESS_COLUMNS
+        )
+    )
+    for column_name in ADDRESS_COLUMNS:
+        op.drop_column('messages', column_name)
+        op.alter_column('messages', f'{column_name}_new', new_column_name=column_name)
+
+    # Containment lookups, e.g. to_addrs @> ARRAY['someone@example.com']
+    op.create_index('ix_messages_to_addrs_gin', 'messages', ['to_addrs'], unique=False, postgresql_using='gin')
+    op.create_index('ix_messages_cc_addrs_gin', 'messages', ['cc_addrs'], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_messages_cc_addrs_gin', table_name='messages')
+    op.drop_index('ix_messages_to_addrs_gin', table_name='messages')
+
+    for column_name in ADDRESS_COLUMNS:
+        op.alter_column(
+            'messages', column_name,
+            type_=postgresql.JSONB(),
+            existing_type=postgresql.ARRAY(sa.String()),
+            postgresql_using=f'to_jsonb({column_name})'
+        )
+
+    op.create_index('ix_messages_to_addrs_gin', 'messages', ['to_addrs'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'to_addrs': 'jsonb_path_ops'})
+    op.create_index('ix_messages_cc_addrs_gin', 'messages', ['cc_addrs'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'cc_addrs': 'jsonb_path_ops'})
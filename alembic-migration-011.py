@@ -0,0 +1,61 @@
+"""compress message html bodies with zstd
+
+Revision ID: 011
+Revises: 010
+Create Date: 2024-04-05 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import zstandard
+
+# revision identifiers
+revision = '011'
+down_revision = '010'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+
+def _convert(source: str, target: str, transform) -> None:
+    """Rewrite message_bodies.source into target in primary key order, one batch at a time"""
+    conn = op.get_bind()
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.text(
+                f'SELECT message_id, {source} FROM message_bodies '
+                f'WHERE message_id > :last_id AND {source} IS NOT NULL '
+                'ORDER BY message_id LIMIT :limit'
+            ),
+            {'last_id': last_id, 'limit': BATCH_SIZE}
+        ).all()
+        if not rows:
+            break
+        conn.execute(
+            sa.text(f'UPDATE message_bodies SET {target} = :value WHERE message_id = :message_id'),
+            [{'message_id': message_id, 'value': transform(value)} for message_id, value in rows]
+        )
+        last_id = rows[-1][0]
+
+
+def upgrade() -> None:
+    op.add_column('message_bodies', sa.Column('body_html_zstd', sa.LargeBinary(), nullable=True))
+    # Already compressed, so skip pglz and keep TOAST out-of-line
+    op.execute('ALTER TABLE message_bodies ALTER COLUMN body_html_zstd SET STORAGE EXTERNAL')
+
+    compressor = zstandard.ZstdCompressor(level=3)
+    _convert('body_html', 'body_html_zstd', lambda html: compressor.compress(html.encode('utf-8')))
+
+    op.drop_column('message_bodies', 'body_html')
+
+
+def downgrade() -> None:
+    op.add_column('message_bodies', sa.Column('body_html', sa.Text(), nullable=True))
+    op.execute('ALTER TABLE message_bodies ALTER COLUMN body_html SET STORAGE EXTERNAL')
+
+    decompressor = zstandard.ZstdDecompressor()
+    _convert('body_html_zstd', 'body_html', lambda data: decompressor.decompress(data).decode('utf-8'))
+
+    op.drop_column('message_bodies', 'body_html_zstd')
@@ -0,0 +1,44 @@
+"""replace sync_state json with typed sync columns
+
+Revision ID: 012
+Revises: 011
+Create Date: 2024-04-12 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers
+revision = '012'
+down_revision = '011'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('email_accounts', sa.Column('gmail_history_id', sa.BigInteger(), nullable=True))
+    op.add_column('email_accounts', sa.Column('outlook_delta_link', sa.Text(), nullable=True))
+
+    # Carry over existing sync positions so accounts keep syncing incrementally
+    op.execute(
+        "UPDATE email_accounts SET "
+        "gmail_history_id = (sync_state->>'history_id')::bigint, "
+        "outlook_delta_link = sync_state->>'delta_link' "
+        "WHERE sync_state IS NOT NULL"
+    )
+
+    op.drop_column('email_accounts', 'sync_state')
+
+
+def downgrade() -> None:
+    op.add_column('email_accounts', sa.Column('sync_state', postgresql.JSONB(), nullable=True))
+
+    op.execute(
+        "UPDATE email_accounts SET sync_state = jsonb_strip_nulls(jsonb_build_object("
+        "'history_id', gmail_history_id::text, "
+        "'delta_link', outlook_delta_link))"
+    )
+
+    op.drop_column('email_accounts', 'outlook_delta_link')
+    op.drop_column('email_accounts', 'gmail_history_id')
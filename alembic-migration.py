@@ -28,7 +28,6 @@ def upgrade() -> None:
         sa.PrimaryKeyConstraint('id')
     )
     op.create_index(op.f('ix_users_email'), 'users', ['email'], unique=True)
-    op.create_index(op.f('ix_users_id'), 'users', ['id'], unique=False)
 
     # Create email_accounts table
     op.create_table(
@@ -49,7 +48,6 @@ def upgrade() -> None:
         sa.PrimaryKeyConstraint('id')
     )
     op.create_index(op.f('ix_email_accounts_email_address'), 'email_accounts', ['email_address'], unique=False)
-    op.create_index(op.f('ix_email_accounts_id'), 'email_accounts', ['id'], unique=False)
     op.create_index(op.f('ix_email_accounts_user_id'), 'email_accounts', ['user_id'], unique=False)
 
     # Create threads table
@@ -66,7 +64,6 @@ def upgrade() -> None:
         sa.PrimaryKeyConstraint('id')
     )
     op.create_index(op.f('ix_threads_account_id'), 'threads', ['account_id'], unique=False)
-    op.create_index(op.f('ix_threads_id'), 'threads', ['id'], unique=False)
     op.create_index(op.f('ix_threads_last_message_at'), 'threads', ['last_message_at'], unique=False)
     op.create_index(op.f('ix_threads_provider_thread_id'), 'threads', ['provider_thread_id'], unique=False)
 
@@ -91,7 +88,6 @@ def upgrade() -> None:
         sa.PrimaryKeyConstraint('id')
     )
     op.create_index(op.f('ix_messages_date'), 'messages', ['date'], unique=False)
-    op.create_index(op.f('ix_messages_id'), 'messages', ['id'], unique=False)
     op.create_index(op.f('ix_messages_provider_message_id'), 'messages', ['provider_message_id'], unique=True)
     op.create_index(op.f('ix_messages_thread_id'), 'messages', ['thread_id'], unique=False)
 
@@ -108,32 +104,26 @@ def upgrade() -> None:
         sa.ForeignKeyConstraint(['message_id'], ['messages.id'], ondelete='CASCADE'),
         sa.PrimaryKeyConstraint('id')
     )
-    op.create_index(op.f('ix_attachments_id'), 'attachments', ['id'], unique=False)
     op.create_index(op.f('ix_attachments_message_id'), 'attachments', ['message_id'], unique=False)
 
 
 def downgrade() -> None:
     op.drop_index(op.f('ix_attachments_message_id'), table_name='attachments')
-    op.drop_index(op.f('ix_attachments_id'), table_name='attachments')
     op.drop_table('attachments')
     
     op.drop_index(op.f('ix_messages_thread_id'), table_name='messages')
     op.drop_index(op.f('ix_messages_provider_message_id'), table_name='messages')
-    op.drop_index(op.f('ix_messages_id'), table_name='messages')
     op.drop_index(op.f('ix_messages_date'), table_name='messages')
     op.drop_table('messages')
     
     op.drop_index(op.f('ix_threads_provider_thread_id'), table_name='threads')
     op.drop_index(op.f('ix_threads_last_message_at'), table_name='threads')
-    op.drop_index(op.f('ix_threads_id'), table_name='threads')
     op.drop_index(op.f('ix_threads_account_id'), table_name='threads')
     op.drop_table('threads')
     
     op.drop_index(op.f('ix_email_accounts_user_id'), table_name='email_accounts')
-    op.drop_index(op.f('ix_email_accounts_id'), table_name='email_accounts')
     op.drop_index(op.f('ix_email_accounts_email_address'), table_name='email_accounts')
     op.drop_table('email_accounts')
     
-    op.drop_index(op.f('ix_users_id'), table_name='users')
     op.drop_index(op.f('ix_users_email'), table_name='users')
     op.drop_table('users')
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, delete, bindparam
+from sqlalchemy.orm import load_only
 from typing import List
 from src.database import get_db
 from src.models.email_account import EmailAccount
@@ -11,6 +12,40 @@ from src.tasks.sync_tasks import sync_account_task
 
 router = APIRouter()
 
+# Only the columns EmailAccountSchema exposes; tokens and sync state stay in the table
+_SCHEMA_COLUMNS = load_only(
+    EmailAccount.id,
+    EmailAccount.user_id,
+    EmailAccount.provider,
+    EmailAccount.email_address,
+    EmailAccount.display_name,
+    EmailAccount.is_active,
+    EmailAccount.last_synced_at,
+    EmailAccount.created_at
+)
+
+# Statements are built once; asyncpg reuses the prepared plan per connection
+_LIST_ACCOUNTS_STMT = (
+    select(EmailAccount)
+    .options(_SCHEMA_COLUMNS)
+    .where(EmailAccount.user_id == bindparam("uid"))
+    .order_by(EmailAccount.created_at.desc())
+)
+
+_GET_ACCOUNT_STMT = select(EmailAccount).options(_SCHEMA_COLUMNS).where(
+    EmailAccount.id == bindparam("account_id"),
+    EmailAccount.user_id == bindparam("uid")
+)
+
+_DELETE_ACCOUNT_STMT = (
+    delete(EmailAccount)
+    .where(
+        EmailAccount.id == bindparam("account_id"),
+        EmailAccount.user_id == bindparam("uid")
+    )
+    .returning(EmailAccount.id)
+)
+
 
 @router.get("/", response_model=List[EmailAccountSchema])
 async def list_accounts(
@@ -18,11 +53,7 @@ async def list_accounts(
     db: AsyncSession = Depends(get_db)
 ):
     """List all connected email accounts for current user"""
-    result = await db.execute(
-        select(EmailAccount)
-        .where(EmailAccount.user_id == current_user.id)
-        .order_by(EmailAccount.created_at.desc())
-    )
+    result = await db.execute(_LIST_ACCOUNTS_STMT, {"uid": current_user.id})
     accounts = result.scalars().all()
     return accounts
 
@@ -35,10 +66,7 @@ async def get_account(
 ):
     """Get specific email account"""
     result = await db.execute(
-        select(EmailAccount).where(
-            EmailAccount.id == account_id,
-            EmailAccount.user_id == current_user.id
-        )
+        _GET_ACCOUNT_STMT, {"account_id": account_id, "uid": current_user.id}
     )
     account = result.scalar_one_or_none()
     
@@ -55,18 +83,14 @@ async def delete_account(
     db: AsyncSession = Depends(get_db)
 ):
     """Delete/disconnect an email account"""
+    # Threads, messages and attachments go with it via ON DELETE CASCADE
     result = await db.execute(
-        select(EmailAccount).where(
-            EmailAccount.id == account_id,
-            EmailAccount.user_id == current_user.id
-        )
+        _DELETE_ACCOUNT_STMT, {"account_id": account_id, "uid": current_user.id}
     )
-    account = result.scalar_one_or_none()
     
-    if not account:
+    if result.scalar_one_or_none() is None:
         raise HTTPException(status_code=404, detail="Account not found")
     
-    await db.delete(account)
     await db.commit()
     
     return {"status": "deleted", "account_id": account_id}
@@ -80,17 +104,14 @@ async def trigger_sync(
 ):
     """Manually trigger sync for an account"""
     result = await db.execute(
-        select(EmailAccount).where(
-            EmailAccount.id == account_id,
-            EmailAccount.user_id == current_user.id
-        )
+        _GET_ACCOUNT_STMT, {"account_id": account_id, "uid": current_user.id}
     )
     account = result.scalar_one_or_none()
     
     if not account:
         raise HTTPException(status_code=404, detail="Account not found")
     
-    # Trigger sync task
-    task = sync_account_task.delay(account_id)
+    # Trigger sync task (fire-and-forget, no result is stored)
+    sync_account_task.delay(account_id)
     
-    return {"status": "sync_triggered", "task_id": task.id}
+    return {"status": "sync_triggered", "account_id": account_id}
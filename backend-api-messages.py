@@ -1,68 +1,129 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, or_
-from typing import List, Optional
+from sqlalchemy import select, and_, or_, tuple_, bindparam
+from typing import List, Optional, Tuple
+from sqlalchemy.orm import selectinload, joinedload
+from datetime import datetime, timedelta, timezone
+from pydantic import TypeAdapter
+import pybase64
 from src.database import get_db
 from src.models.user import User
 from src.models.email_account import EmailAccount, EmailProvider
 from src.models.thread import Thread
 from src.models.message import Message
 from src.api.deps import get_current_user
-from src.schemas import InboxMessageSchema, ThreadSchema, MessageSchema, SendMessageRequest
+from src.schemas import InboxMessageSchema, InboxPage, ThreadSchema, MessageSchema, SendMessageRequest
 from src.services.gmail import gmail_service
 from src.services.outlook import outlook_service
+from src.services.token_manager import token_manager
 
 router = APIRouter()
 
+# Validate whole result lists in one call into pydantic-core
+_MESSAGE_LIST_ADAPTER = TypeAdapter(List[MessageSchema])
+_INBOX_LIST_ADAPTER = TypeAdapter(List[InboxMessageSchema])
 
-@router.get("/inbox", response_model=List[InboxMessageSchema])
+# Send handler per provider; all accept the same keyword arguments
+_PROVIDER_SEND = {
+    EmailProvider.GMAIL: gmail_service.send_message,
+    EmailProvider.OUTLOOK: outlook_service.send_message,
+}
+
+_GET_MESSAGE_STMT = (
+    select(Message)
+    .options(selectinload(Message.attachments))
+    .join(Thread)
+    .join(EmailAccount)
+    .where(
+        and_(
+            Message.id == bindparam("message_id"),
+            EmailAccount.user_id == bindparam("uid")
+        )
+    )
+)
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def encode_cursor(date: Optional[datetime], message_id: int) -> str:
+    """Encode a (date, id) keyset position as an opaque, URL-safe cursor"""
+    micros = '' if date is None else str((date - _EPOCH) // _MICROSECOND)
+    return pybase64.urlsafe_b64encode(f"{micros},{message_id}".encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], int]:
+    """Decode a cursor produced by encode_cursor; the date is None for undated messages"""
+    try:
+        raw = pybase64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        micros, message_id = raw.split(',')
+        date = _EPOCH + int(micros) * _MICROSECOND if micros else None
+        return date, int(message_id)
+    except (ValueError, TypeError, OverflowError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@router.get("/inbox", response_model=InboxPage)
 async def get_inbox(
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
     account_id: Optional[int] = Query(None),
     provider: Optional[str] = Query(None),
-    limit: int = Query(50, le=100),
-    offset: int = Query(0)
+    limit: int = Query(50, ge=1, le=100),
+    cursor: Optional[str] = Query(None)
 ):
-    """Get unified inbox messages"""
-    # Build query
+    """Get unified inbox messages, newest first, using keyset pagination"""
+    # Single index scan on messages; account/thread fields are denormalized
+    user_accounts = select(EmailAccount.id).where(EmailAccount.user_id == current_user.id)
     query = (
-        select(Message, Thread, EmailAccount)
-        .join(Thread, Message.thread_id == Thread.id)
-        .join(EmailAccount, Thread.account_id == EmailAccount.id)
-        .where(EmailAccount.user_id == current_user.id)
+        select(
+            Message.id,
+            Message.thread_id,
+            Message.account_id,
+            Message.account_email,
+            Message.provider,
+            Message.from_addr,
+            Message.subject,
+            Message.thread_snippet.label('snippet'),
+            Message.date,
+            Message.has_attachments,
+            Message.is_read
+        )
+        .where(Message.account_id.in_(user_accounts))
     )
     
     # Apply filters
     if account_id:
-        query = query.where(EmailAccount.id == account_id)
+        query = query.where(Message.account_id == account_id)
     if provider:
-        query = query.where(EmailAccount.provider == provider)
+        query = query.where(Message.provider == provider)
+    
+    # Resume after the last message of the previous page. Undated messages sort
+    # first (Postgres' NULLS FIRST for DESC, matching the date DESC indexes).
+    if cursor:
+        cursor_date, cursor_id = decode_cursor(cursor)
+        if cursor_date is None:
+            query = query.where(
+                or_(Message.date.is_not(None), Message.id < cursor_id)
+            )
+        else:
+            query = query.where(tuple_(Message.date, Message.id) < (cursor_date, cursor_id))
     
     # Order and paginate
-    query = query.order_by(Message.date.desc()).limit(limit).offset(offset)
+    query = query.order_by(Message.date.desc().nulls_first(), Message.id.desc()).limit(limit)
     
     result = await db.execute(query)
-    rows = result.all()
-    
-    # Transform to response format
-    messages = []
-    for msg, thread, account in rows:
-        messages.append(InboxMessageSchema(
-            id=msg.id,
-            thread_id=thread.id,
-            account_id=account.id,
-            account_email=account.email_address,
-            provider=account.provider,
-            from_addr=msg.from_addr,
-            subject=msg.subject,
-            snippet=thread.snippet,
-            date=msg.date,
-            has_attachments=msg.has_attachments,
-            is_read=msg.is_read
-        ))
-    
-    return messages
+    messages = _INBOX_LIST_ADAPTER.validate_python(result.all(), from_attributes=True)
+    
+    next_cursor = None
+    if len(messages) == limit:
+        last = messages[-1]
+        next_cursor = encode_cursor(last.date, last.id)
+    
+    # Serialize in pydantic-core; skips FastAPI re-validating the response model
+    page = InboxPage(messages=messages, next_cursor=next_cursor)
+    return Response(content=page.model_dump_json(), media_type="application/json")
 
 
 @router.get("/threads/{thread_id}", response_model=ThreadSchema)
@@ -72,9 +133,15 @@ async def get_thread(
     db: AsyncSession = Depends(get_db)
 ):
     """Get thread with all messages"""
-    # Get thread
+    # Get thread with its messages (and their attachments) eagerly loaded
     result = await db.execute(
         select(Thread)
+        .options(
+            selectinload(Thread.messages).options(
+                selectinload(Message.attachments),
+                selectinload(Message.body)
+            )
+        )
         .join(EmailAccount)
         .where(
             and_(
@@ -88,14 +155,6 @@ async def get_thread(
     if not thread:
         raise HTTPException(status_code=404, detail="Thread not found")
     
-    # Get messages
-    messages_result = await db.execute(
-        select(Message)
-        .where(Message.thread_id == thread_id)
-        .order_by(Message.date.asc())
-    )
-    messages = messages_result.scalars().all()
-    
     # Build response
     return ThreadSchema(
         id=thread.id,
@@ -104,7 +163,7 @@ async def get_thread(
         subject=thread.subject,
         snippet=thread.snippet,
         last_message_at=thread.last_message_at,
-        messages=[MessageSchema.from_orm(msg) for msg in messages]
+        messages=_MESSAGE_LIST_ADAPTER.validate_python(thread.messages, from_attributes=True)
     )
 
 
@@ -128,30 +187,29 @@ async def send_message(
     
     if not account:
         raise HTTPException(status_code=404, detail="Account not found")
+    if not account.is_active:
+        raise HTTPException(status_code=401, detail="Account disconnected, please reconnect")
     
+    # Refresh ahead of expiry instead of letting the provider reject the token
     try:
-        # Send via appropriate service
-        if account.provider == EmailProvider.GMAIL:
-            result = await gmail_service.send_message(
-                access_token=account.access_token,
-                to=request.to,
-                subject=request.subject,
-                body_html=request.body_html,
-                body_text=request.body_text,
-                in_reply_to=request.in_reply_to,
-                references=request.references
-            )
-        elif account.provider == EmailProvider.OUTLOOK:
-            result = await outlook_service.send_message(
-                access_token=account.access_token,
-                to=request.to,
-                subject=request.subject,
-                body_html=request.body_html,
-                body_text=request.body_text,
-                in_reply_to=request.in_reply_to
-            )
-        else:
-            raise HTTPException(status_code=400, detail="Unsupported provider")
+        access_token = await token_manager.get_valid_token(account, db)
+    except Exception:
+        raise HTTPException(status_code=401, detail="Could not refresh access token, please reconnect")
+    
+    handler = _PROVIDER_SEND.get(account.provider)
+    if handler is None:
+        raise HTTPException(status_code=400, detail="Unsupported provider")
+    
+    try:
+        result = await handler(
+            access_token=access_token,
+            to=request.to,
+            subject=request.subject,
+            body_html=request.body_html,
+            body_text=request.body_text,
+            in_reply_to=request.in_reply_to,
+            references=request.references
+        )
         
         return {"status": "sent", "result": result}
     
@@ -163,19 +221,17 @@ async def send_message(
 async def get_message(
     message_id: int,
     current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    include_body: bool = Query(True)
 ):
     """Get specific message"""
+    stmt = _GET_MESSAGE_STMT
+    if include_body:
+        # Bodies live in message_bodies; only join when they are requested
+        stmt = stmt.options(joinedload(Message.body))
+    
     result = await db.execute(
-        select(Message)
-        .join(Thread)
-        .join(EmailAccount)
-        .where(
-            and_(
-                Message.id == message_id,
-                EmailAccount.user_id == current_user.id
-            )
-        )
+        stmt, {"message_id": message_id, "uid": current_user.id}
     )
     message = result.scalar_one_or_none()
     
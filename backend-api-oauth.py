@@ -1,7 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from fastapi.responses import RedirectResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from datetime import datetime, timedelta
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.sql import func
+from datetime import timedelta
+from src.config import settings
 from src.database import get_db
 from src.models.email_account import EmailAccount, EmailProvider
 from src.models.user import User
@@ -10,19 +13,70 @@ from src.services.gmail import gmail_service
 from src.services.outlook import outlook_service
 from src.services.encryption import encryption_service
 from src.tasks.sync_tasks import sync_account_task
-import secrets
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from typing import Optional
 
 router = APIRouter()
 
-# Store state tokens temporarily (in production, use Redis)
-oauth_states = {}
+# OAuth state is a signed, timestamped token, so no server-side storage is needed
+OAUTH_STATE_TTL_SECONDS = 600
+state_serializer = URLSafeTimedSerializer(settings.SECRET_KEY, salt="oauth-state")
+
+
+def create_oauth_state(user_id: int, provider: str) -> str:
+    return state_serializer.dumps({'uid': user_id, 'provider': provider})
+
+
+def load_oauth_state(state: str, provider: str) -> Optional[int]:
+    """Return the user id from a valid, unexpired state token for this provider"""
+    try:
+        data = state_serializer.loads(state, max_age=OAUTH_STATE_TTL_SECONDS)
+    except BadSignature:
+        return None
+    if data.get('provider') != provider:
+        return None
+    return data['uid']
+
+
+async def upsert_email_account(
+    db: AsyncSession,
+    user_id: int,
+    provider: EmailProvider,
+    email_address: str,
+    display_name: str,
+    access_token: str,
+    encrypted_refresh_token: Optional[str],
+    expires_in: int
+) -> EmailAccount:
+    """Insert an email account or refresh the tokens of an existing one"""
+    stmt = pg_insert(EmailAccount).values(
+        user_id=user_id,
+        provider=provider,
+        email_address=email_address,
+        display_name=display_name,
+        access_token=access_token,
+        encrypted_refresh_token=encrypted_refresh_token,
+        token_expiry=func.now() + timedelta(seconds=expires_in),
+        is_active=True
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['user_id', 'email_address', 'provider'],
+        set_={
+            'access_token': stmt.excluded.access_token,
+            'encrypted_refresh_token': stmt.excluded.encrypted_refresh_token,
+            'token_expiry': stmt.excluded.token_expiry,
+            'is_active': True
+        }
+    ).returning(EmailAccount)
+    
+    result = await db.execute(stmt)
+    return result.scalar_one()
 
 
 @router.get("/gmail/authorize")
 async def gmail_authorize(current_user: User = Depends(get_current_user)):
     """Initiate Gmail OAuth flow"""
-    state = secrets.token_urlsafe(32)
-    oauth_states[state] = {'user_id': current_user.id, 'provider': 'gmail'}
+    state = create_oauth_state(current_user.id, 'gmail')
     
     auth_url = gmail_service.get_authorization_url(state)
     return {'authorization_url': auth_url}
@@ -36,12 +90,10 @@ async def gmail_callback(
 ):
     """Handle Gmail OAuth callback"""
     # Verify state
-    if state not in oauth_states:
+    user_id = load_oauth_state(state, 'gmail')
+    if user_id is None:
         raise HTTPException(status_code=400, detail="Invalid state parameter")
     
-    state_data = oauth_states.pop(state)
-    user_id = state_data['user_id']
-    
     try:
         # Exchange code for tokens
         tokens = await gmail_service.exchange_code_for_tokens(code)
@@ -52,40 +104,20 @@ async def gmail_callback(
         # Get user profile
         profile = await gmail_service.get_user_profile(access_token)
         email_address = profile['emailAddress']
+        encrypted_refresh_token = await encryption_service.encrypt_async(refresh_token) if refresh_token else None
         
-        # Check if account already exists
-        from sqlalchemy import select
-        result = await db.execute(
-            select(EmailAccount).where(
-                EmailAccount.user_id == user_id,
-                EmailAccount.email_address == email_address,
-                EmailAccount.provider == EmailProvider.GMAIL
-            )
+        # Create or update the account in a single upsert
+        account = await upsert_email_account(
+            db,
+            user_id=user_id,
+            provider=EmailProvider.GMAIL,
+            email_address=email_address,
+            display_name=email_address,
+            access_token=access_token,
+            encrypted_refresh_token=encrypted_refresh_token,
+            expires_in=expires_in
         )
-        account = result.scalar_one_or_none()
-        
-        if account:
-            # Update existing account
-            account.access_token = access_token
-            account.encrypted_refresh_token = encryption_service.encrypt(refresh_token) if refresh_token else None
-            account.token_expiry = datetime.utcnow() + timedelta(seconds=expires_in)
-            account.is_active = True
-        else:
-            # Create new account
-            account = EmailAccount(
-                user_id=user_id,
-                provider=EmailProvider.GMAIL,
-                email_address=email_address,
-                display_name=email_address,
-                access_token=access_token,
-                encrypted_refresh_token=encryption_service.encrypt(refresh_token) if refresh_token else None,
-                token_expiry=datetime.utcnow() + timedelta(seconds=expires_in),
-                is_active=True
-            )
-            db.add(account)
-        
         await db.commit()
-        await db.refresh(account)
         
         # Trigger initial sync
         sync_account_task.delay(account.id)
@@ -100,8 +132,7 @@ async def gmail_callback(
 @router.get("/outlook/authorize")
 async def outlook_authorize(current_user: User = Depends(get_current_user)):
     """Initiate Outlook OAuth flow"""
-    state = secrets.token_urlsafe(32)
-    oauth_states[state] = {'user_id': current_user.id, 'provider': 'outlook'}
+    state = create_oauth_state(current_user.id, 'outlook')
     
     auth_url = outlook_service.get_authorization_url(state)
     return {'authorization_url': auth_url}
@@ -115,12 +146,10 @@ async def outlook_callback(
 ):
     """Handle Outlook OAuth callback"""
     # Verify state
-    if state not in oauth_states:
+    user_id = load_oauth_state(state, 'outlook')
+    if user_id is None:
         raise HTTPException(status_code=400, detail="Invalid state parameter")
     
-    state_data = oauth_states.pop(state)
-    user_id = state_data['user_id']
-    
     try:
         # Exchange code for tokens
         tokens = await outlook_service.exchange_code_for_tokens(code)
@@ -132,46 +161,25 @@ async def outlook_callback(
         profile = await outlook_service.get_user_profile(access_token)
         email_address = profile['mail'] or profile['userPrincipalName']
         display_name = profile.get('displayName', email_address)
+        encrypted_refresh_token = await encryption_service.encrypt_async(refresh_token) if refresh_token else None
         
-        # Check if account already exists
-        from sqlalchemy import select
-        result = await db.execute(
-            select(EmailAccount).where(
-                EmailAccount.user_id == user_id,
-                EmailAccount.email_address == email_address,
-                EmailAccount.provider == EmailProvider.OUTLOOK
-            )
+        # Create or update the account in a single upsert
+        account = await upsert_email_account(
+            db,
+            user_id=user_id,
+            provider=EmailProvider.OUTLOOK,
+            email_address=email_address,
+            display_name=display_name,
+            access_token=access_token,
+            encrypted_refresh_token=encrypted_refresh_token,
+            expires_in=expires_in
         )
-        account = result.scalar_one_or_none()
-        
-        if account:
-            # Update existing account
-            account.access_token = access_token
-            account.encrypted_refresh_token = encryption_service.encrypt(refresh_token) if refresh_token else None
-            account.token_expiry = datetime.utcnow() + timedelta(seconds=expires_in)
-            account.is_active = True
-        else:
-            # Create new account
-            account = EmailAccount(
-                user_id=user_id,
-                provider=EmailProvider.OUTLOOK,
-                email_address=email_address,
-                display_name=display_name,
-                access_token=access_token,
-                encrypted_refresh_token=encryption_service.encrypt(refresh_token) if refresh_token else None,
-                token_expiry=datetime.utcnow() + timedelta(seconds=expires_in),
-                is_active=True
-            )
-            db.add(account)
-        
         await db.commit()
-        await db.refresh(account)
         
         # Trigger initial sync
         sync_account_task.delay(account.id)
         
         # Redirect to frontend
-        from src.config import settings
         return RedirectResponse(url=f"{settings.BASE_URL}/#/dashboard?connected=outlook")
     
     except Exception as e:
@@ -12,15 +12,25 @@ celery_app = Celery(
 
 # Configure Celery
 celery_app.conf.update(
-    task_serializer='json',
-    accept_content=['json'],
-    result_serializer='json',
+    # Compact binary payloads; json is still accepted for messages queued before the switch
+    task_serializer='msgpack',
+    accept_content=['msgpack', 'json'],
+    result_serializer='msgpack',
+    task_compression='zstd',
     timezone='UTC',
     enable_utc=True,
-    task_track_started=True,
+    # Results are opt-in: tasks that need them set ignore_result=False
+    task_ignore_result=True,
     task_time_limit=300,  # 5 minutes max per task
-    worker_prefetch_multiplier=1,
+    # Each task drives its own asyncio.run loop, so the sync worker uses the
+    # prefork pool (see docker-compose); greenlet pools cannot share that loop
+    worker_prefetch_multiplier=4,
+    worker_concurrency=8,
+    task_acks_late=True,
     worker_max_tasks_per_child=1000,
+    task_routes={
+        'src.tasks.sync_tasks.*': {'queue': 'sync'},
+    },
 )
 
 # Periodic task schedule
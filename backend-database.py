@@ -1,3 +1,4 @@
+import asyncio
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base
 from src.config import settings
@@ -6,8 +7,16 @@ engine = create_async_engine(
     settings.DATABASE_URL,
     echo=settings.ENVIRONMENT == "development",
     pool_pre_ping=True,
-    pool_size=10,
-    max_overflow=20
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    connect_args={
+        # Per-connection caches of prepared statements (SQLAlchemy adapter and asyncpg)
+        "prepared_statement_cache_size": 1024,
+        "statement_cache_size": 1024,
+        # Short OLTP queries never benefit from JIT compilation
+        "server_settings": {"jit": "off"},
+    }
 )
 
 AsyncSessionLocal = async_sessionmaker(
@@ -21,6 +30,18 @@ AsyncSessionLocal = async_sessionmaker(
 Base = declarative_base()
 
 
+async def warm_pool():
+    """Open pool_size connections up front so first requests skip connect/auth"""
+    results = await asyncio.gather(
+        *(engine.connect() for _ in range(engine.pool.size())), return_exceptions=True
+    )
+    # Return every connection that did open, even if another connect failed
+    await asyncio.gather(*(r.close() for r in results if not isinstance(r, BaseException)))
+    for r in results:
+        if isinstance(r, BaseException):
+            raise r
+
+
 async def get_db():
     async with AsyncSessionLocal() as session:
         try:
@@ -1,18 +1,39 @@
+import asyncio
+from functools import lru_cache
 from cryptography.fernet import Fernet
+import zstandard
 from src.config import settings
 
+# Prefix marking a zstd-compressed plaintext; older tokens are raw UTF-8
+FORMAT_ZSTD = b'\x01'
+
 
 class EncryptionService:
     def __init__(self):
         self.cipher = Fernet(settings.FERNET_KEY.encode())
+        # Keyed by ciphertext, so a rotated refresh token is simply a new entry
+        self.decrypt_cached = lru_cache(maxsize=1024)(self.decrypt)
+    
+    def _pack(self, data: str) -> bytes:
+        return FORMAT_ZSTD + zstandard.compress(data.encode(), 3)
+    
+    def _unpack(self, payload: bytes) -> str:
+        if payload[:1] == FORMAT_ZSTD:
+            return zstandard.decompress(payload[1:]).decode()
+        return payload.decode()
     
     def encrypt(self, data: str) -> str:
-        """Encrypt a string and return base64 encoded encrypted data"""
-        return self.cipher.encrypt(data.encode()).decode()
+        """Compress and encrypt a string and return base64 encoded encrypted data"""
+        return self.cipher.encrypt(self._pack(data)).decode()
     
     def decrypt(self, encrypted_data: str) -> str:
         """Decrypt base64 encoded encrypted data and return original string"""
-        return self.cipher.decrypt(encrypted_data.encode()).decode()
+        return self._unpack(self.cipher.decrypt(encrypted_data.encode()))
+    
+    async def encrypt_async(self, data: str) -> str:
+        """Encrypt in the default executor so the event loop is not blocked"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.encrypt, data)
 
 
 encryption_service = EncryptionService()
@@ -1,12 +1,108 @@
-import base64
-from datetime import datetime, timedelta
-from typing import Optional, List, Dict
+import asyncio
+import json
+import weakref
+import pybase64
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from datetime import datetime, timedelta, timezone
+from email.utils import getaddresses, parsedate_to_datetime
+from typing import AsyncIterator, Optional, List, Dict
+from urllib.parse import quote, urlencode
+from aiolimiter import AsyncLimiter
+from cachetools import TTLCache
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
 from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
+import httplib2
 import httpx
 from src.config import settings
 
+# Concurrent messages.get calls per round, with a short pause between rounds
+FETCH_CONCURRENCY = 25
+FETCH_ROUND_DELAY = 0.05
+
+# Per-user quota in units per second, and the unit cost of each call we make
+QUOTA_UNITS_PER_SECOND = 250
+COST_GET = 5
+COST_LIST = 5
+COST_HISTORY = 2
+COST_PROFILE = 1
+COST_SEND = 100
+
+# Sub-requests per batch call; 50 gets spend one second of quota
+BATCH_SIZE = 50
+METADATA_HEADERS = ['From', 'To', 'Cc', 'Subject', 'Date']
+
+# Pre-encoded MIME fragments for outgoing multipart/alternative messages.
+# Parts are base64 encoded, so the boundary can never appear in a body.
+MIME_BOUNDARY = b'=_unified_inbox_alt'
+MIME_HEADER = (
+    b'MIME-Version: 1.0\r\n'
+    b'Content-Type: multipart/alternative; boundary="' + MIME_BOUNDARY + b'"\r\n\r\n'
+)
+MIME_PART_PLAIN = (
+    b'--' + MIME_BOUNDARY + b'\r\n'
+    b'Content-Type: text/plain; charset="utf-8"\r\n'
+    b'Content-Transfer-Encoding: base64\r\n\r\n'
+)
+MIME_PART_HTML = (
+    b'--' + MIME_BOUNDARY + b'\r\n'
+    b'Content-Type: text/html; charset="utf-8"\r\n'
+    b'Content-Transfer-Encoding: base64\r\n\r\n'
+)
+MIME_END = b'--' + MIME_BOUNDARY + b'--\r\n'
+
+
+@lru_cache(maxsize=1)
+def _discovery_doc() -> Dict:
+    """Parse the bundled Gmail discovery document once per process"""
+    return json.loads(get_static_doc('gmail', 'v1'))
+
+
+def _parse_addresses(headers: List[Dict], name: str) -> List[str]:
+    """Extract bare addresses from every `name` header, honouring quoted names that contain commas"""
+    name = name.lower()
+    values = [h['value'] for h in headers if h['name'].lower() == name]
+    return [addr for _, addr in getaddresses(values) if addr]
+
+
+def _header(name: str, value: str) -> bytes:
+    """Format one header line, RFC 2047 encoding non-ASCII values"""
+    value = ' '.join(value.splitlines())  # no header injection via CR/LF
+    if not value.isascii():
+        value = f"=?utf-8?b?{pybase64.b64encode(value.encode()).decode()}?="
+    return f"{name}: {value}\r\n".encode()
+
+
+def _body_part(prefix: bytes, content: str) -> bytes:
+    """Base64 encode a text part, wrapped at 76 columns as RFC 2045 requires"""
+    return prefix + pybase64.encodebytes(content.encode()).replace(b'\n', b'\r\n')
+
+
+def build_mime_message(
+    to: List[str],
+    subject: str,
+    body_html: Optional[str] = None,
+    body_text: Optional[str] = None,
+    in_reply_to: Optional[str] = None,
+    references: Optional[str] = None
+) -> bytes:
+    """Assemble the RFC 5322 multipart/alternative message directly"""
+    parts = [_header('To', ', '.join(to)), _header('Subject', subject)]
+    if in_reply_to:
+        parts.append(_header('In-Reply-To', in_reply_to))
+    if references:
+        parts.append(_header('References', references))
+    parts.append(MIME_HEADER)
+    if body_text:
+        parts.append(_body_part(MIME_PART_PLAIN, body_text))
+    if body_html:
+        parts.append(_body_part(MIME_PART_HTML, body_html))
+    parts.append(MIME_END)
+    return b''.join(parts)
+
 
 class GmailService:
     def __init__(self):
@@ -17,24 +113,42 @@ class GmailService:
             'https://www.googleapis.com/auth/gmail.readonly',
             'https://www.googleapis.com/auth/gmail.send'
         ]
-    
-    def get_authorization_url(self, state: str) -> str:
-        """Generate OAuth authorization URL"""
-        params = {
+        # Everything but state is fixed, so encode it once
+        self._auth_url_base = 'https://accounts.google.com/o/oauth2/v2/auth?' + urlencode({
             'client_id': self.client_id,
             'redirect_uri': self.redirect_uri,
             'response_type': 'code',
             'scope': ' '.join(self.scopes),
             'access_type': 'offline',
-            'prompt': 'consent',
-            'state': state
-        }
-        query = '&'.join([f'{k}={v}' for k, v in params.items()])
-        return f'https://accounts.google.com/o/oauth2/v2/auth?{query}'
+            'prompt': 'consent'
+        })
+        self._client: Optional[httpx.AsyncClient] = None
+        # One limiter per account, keyed by its current access token. Limiters are
+        # bound to an event loop, so each loop (one per Celery task) gets its own cache.
+        self._limiters = weakref.WeakKeyDictionary()
+    
+    def set_client(self, client: Optional[httpx.AsyncClient]):
+        """Use a shared, pooled HTTP client (set by the API lifespan)"""
+        self._client = client
+    
+    @asynccontextmanager
+    async def _http(self, http: Optional[httpx.AsyncClient] = None):
+        """Yield the caller's client, the shared one, or a short-lived one"""
+        if http is not None:
+            yield http
+        elif self._client is not None:
+            yield self._client
+        else:
+            async with httpx.AsyncClient() as client:
+                yield client
+    
+    def get_authorization_url(self, state: str) -> str:
+        """Generate OAuth authorization URL"""
+        return f'{self._auth_url_base}&state={quote(state, safe="")}'
     
     async def exchange_code_for_tokens(self, code: str) -> Dict:
         """Exchange authorization code for access and refresh tokens"""
-        async with httpx.AsyncClient() as client:
+        async with self._http() as client:
             response = await client.post(
                 'https://oauth2.googleapis.com/token',
                 data={
@@ -48,9 +162,9 @@ class GmailService:
             response.raise_for_status()
             return response.json()
     
-    async def refresh_access_token(self, refresh_token: str) -> Dict:
+    async def refresh_access_token(self, refresh_token: str, http: Optional[httpx.AsyncClient] = None) -> Dict:
         """Refresh access token using refresh token"""
-        async with httpx.AsyncClient() as client:
+        async with self._http(http) as client:
             response = await client.post(
                 'https://oauth2.googleapis.com/token',
                 data={
@@ -66,12 +180,28 @@ class GmailService:
     def _get_service(self, access_token: str):
         """Create Gmail API service client"""
         creds = Credentials(token=access_token)
-        return build('gmail', 'v1', credentials=creds)
+        return build_from_document(_discovery_doc(), credentials=creds)
+    
+    def _limiter(self, access_token: str) -> AsyncLimiter:
+        """Token bucket holding the account under Gmail's per-user quota"""
+        loop = asyncio.get_running_loop()
+        limiters = self._limiters.get(loop)
+        if limiters is None:
+            limiters = self._limiters[loop] = TTLCache(maxsize=10000, ttl=3600)
+        limiter = limiters.get(access_token)
+        if limiter is None:
+            limiter = limiters[access_token] = AsyncLimiter(QUOTA_UNITS_PER_SECOND, 1)
+        return limiter
+    
+    async def _execute(self, access_token: str, request, cost: int) -> Dict:
+        """Run a blocking API request in a worker thread once quota allows"""
+        await self._limiter(access_token).acquire(cost)
+        return await asyncio.to_thread(request.execute)
     
     async def get_user_profile(self, access_token: str) -> Dict:
         """Get user's email address and profile info"""
         service = self._get_service(access_token)
-        profile = service.users().getProfile(userId='me').execute()
+        profile = await self._execute(access_token, service.users().getProfile(userId='me'), COST_PROFILE)
         return profile
     
     async def fetch_messages(
@@ -80,50 +210,147 @@ class GmailService:
         max_results: int = 50,
         history_id: Optional[str] = None
     ) -> Dict:
-        """Fetch messages from Gmail"""
+        """List messages to sync; bodies are fetched page by page with iter_messages"""
         service = self._get_service(access_token)
         
         if history_id:
             # Incremental sync using history
             try:
-                history = service.users().history().list(
+                history = await self._execute(access_token, service.users().history().list(
                     userId='me',
                     startHistoryId=history_id,
-                    historyTypes=['messageAdded']
-                ).execute()
+                    historyTypes=['messageAdded'],
+                    maxResults=max_results
+                ), COST_HISTORY)
                 return {'type': 'history', 'data': history}
             except Exception:
                 # If history fails, fall back to full sync
                 pass
         
         # Full sync - get recent messages
-        messages = service.users().messages().list(
+        messages = await self._execute(access_token, service.users().messages().list(
             userId='me',
             maxResults=max_results,
             labelIds=['INBOX']
-        ).execute()
-        
-        message_list = []
-        for msg in messages.get('messages', []):
-            full_msg = service.users().messages().get(
-                userId='me',
-                id=msg['id'],
-                format='full'
-            ).execute()
-            message_list.append(full_msg)
+        ), COST_LIST)
         
         # Get current historyId for next sync
-        profile = service.users().getProfile(userId='me').execute()
+        profile = await self._execute(access_token, service.users().getProfile(userId='me'), COST_PROFILE)
         
         return {
             'type': 'full',
-            'messages': message_list,
+            'message_ids': [msg['id'] for msg in messages.get('messages', [])],
             'history_id': profile.get('historyId')
         }
     
+    def _get_request(self, service, message_id: str, format: str):
+        """Build a messages.get request; metadata requests only carry the listed headers"""
+        kwargs = {'metadataHeaders': METADATA_HEADERS} if format == 'metadata' else {}
+        return service.users().messages().get(userId='me', id=message_id, format=format, **kwargs)
+    
+    async def _get_message(self, service, access_token: str, message_id: str, format: str) -> Dict:
+        """Fetch one message (httplib2 is not thread-safe, so each call gets its own Http)"""
+        await self._limiter(access_token).acquire(COST_GET)
+        http = AuthorizedHttp(Credentials(token=access_token), http=httplib2.Http())
+        return await asyncio.to_thread(self._get_request(service, message_id, format).execute, http=http)
+    
+    async def _get_messages(
+        self,
+        service,
+        access_token: str,
+        message_ids: List[str],
+        format: str
+    ) -> Dict[str, Dict]:
+        """Fetch messages concurrently in rounds of FETCH_CONCURRENCY, skipping failures"""
+        messages = {}
+        for i in range(0, len(message_ids), FETCH_CONCURRENCY):
+            if i:
+                await asyncio.sleep(FETCH_ROUND_DELAY)
+            chunk = message_ids[i:i + FETCH_CONCURRENCY]
+            results = await asyncio.gather(*(
+                self._get_message(service, access_token, message_id, format)
+                for message_id in chunk
+            ), return_exceptions=True)
+            # A message deleted since it was listed must not fail the whole sync
+            messages.update(
+                (message_id, result) for message_id, result in zip(chunk, results)
+                if not isinstance(result, Exception)
+            )
+        return messages
+    
+    async def get_messages(
+        self,
+        access_token: str,
+        message_ids: List[str],
+        format: str = 'full'
+    ) -> List[Dict]:
+        """Fetch messages concurrently, in the order given"""
+        service = self._get_service(access_token)
+        messages = await self._get_messages(service, access_token, message_ids, format)
+        return [messages[message_id] for message_id in message_ids if message_id in messages]
+    
+    def _execute_batch(self, service, message_ids: List[str], format: str) -> Dict[str, Dict]:
+        """Fetch up to BATCH_SIZE messages in one multipart request, skipping failures"""
+        messages = {}
+        
+        def store_msg(request_id, response, exception):
+            if exception is None:
+                messages[request_id] = response
+        
+        batch = service.new_batch_http_request(callback=store_msg)
+        for message_id in message_ids:
+            batch.add(self._get_request(service, message_id, format), request_id=message_id)
+        batch.execute()
+        return messages
+    
+    async def batch_get_messages(
+        self,
+        access_token: str,
+        message_ids: List[str],
+        format: str = 'full'
+    ) -> List[Dict]:
+        """Fetch messages through the batch endpoint, in the order given, leaving out failures"""
+        service = self._get_service(access_token)
+        messages = {}
+        for i in range(0, len(message_ids), BATCH_SIZE):
+            chunk = message_ids[i:i + BATCH_SIZE]
+            await self._limiter(access_token).acquire(COST_GET * len(chunk))
+            messages.update(await asyncio.to_thread(self._execute_batch, service, chunk, format))
+        
+        # Retry sub-requests that failed inside the batch individually
+        missing = [message_id for message_id in message_ids if message_id not in messages]
+        if missing:
+            messages.update(await self._get_messages(service, access_token, missing, format))
+        
+        return [messages[message_id] for message_id in message_ids if message_id in messages]
+    
+    async def iter_messages(
+        self,
+        access_token: str,
+        message_ids: List[str],
+        page_size: int = BATCH_SIZE,
+        format: str = 'full'
+    ) -> AsyncIterator[List[Dict]]:
+        """Yield fetched messages one page at a time, fetching the next page meanwhile"""
+        pages = [message_ids[i:i + page_size] for i in range(0, len(message_ids), page_size)]
+        if not pages:
+            return
+        
+        # At most two pages are held in memory: the one yielded and the one in flight
+        pending = asyncio.ensure_future(self.batch_get_messages(access_token, pages[0], format))
+        try:
+            for next_ids in pages[1:]:
+                messages = await pending
+                pending = asyncio.ensure_future(self.batch_get_messages(access_token, next_ids, format))
+                yield messages
+            yield await pending
+        finally:
+            pending.cancel()
+    
     def parse_message(self, message: Dict) -> Dict:
         """Parse Gmail message into standardized format"""
-        headers = {h['name']: h['value'] for h in message['payload'].get('headers', [])}
+        header_list = message['payload'].get('headers', [])
+        headers = {h['name']: h['value'] for h in header_list}
         
         # Extract body
         body_text = ''
@@ -132,11 +359,11 @@ class GmailService:
         if 'parts' in message['payload']:
             for part in message['payload']['parts']:
                 if part['mimeType'] == 'text/plain' and 'data' in part['body']:
-                    body_text = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8', errors='ignore')
+                    body_text = pybase64.urlsafe_b64decode(part['body']['data']).decode('utf-8', errors='ignore')
                 elif part['mimeType'] == 'text/html' and 'data' in part['body']:
-                    body_html = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8', errors='ignore')
+                    body_html = pybase64.urlsafe_b64decode(part['body']['data']).decode('utf-8', errors='ignore')
         elif 'body' in message['payload'] and 'data' in message['payload']['body']:
-            body_text = base64.urlsafe_b64decode(message['payload']['body']['data']).decode('utf-8', errors='ignore')
+            body_text = pybase64.urlsafe_b64decode(message['payload']['body']['data']).decode('utf-8', errors='ignore')
         
         # Extract attachments
         attachments = []
@@ -153,17 +380,19 @@ class GmailService:
         # Parse date
         date_str = headers.get('Date', '')
         try:
-            from email.utils import parsedate_to_datetime
             date = parsedate_to_datetime(date_str)
         except:
-            date = datetime.utcnow()
+            date = datetime.now(timezone.utc)
+        if date.tzinfo is None:
+            # RFC 2822 "-0000" (unknown zone) parses naive; the time is still UTC
+            date = date.replace(tzinfo=timezone.utc)
         
         return {
             'provider_message_id': message['id'],
             'thread_id': message['threadId'],
             'from_addr': headers.get('From', ''),
-            'to_addrs': headers.get('To', '').split(','),
-            'cc_addrs': headers.get('Cc', '').split(',') if headers.get('Cc') else [],
+            'to_addrs': _parse_addresses(header_list, 'To'),
+            'cc_addrs': _parse_addresses(header_list, 'Cc'),
             'subject': headers.get('Subject', ''),
             'date': date,
             'body_text': body_text,
@@ -181,37 +410,21 @@ class GmailService:
         body_html: Optional[str] = None,
         body_text: Optional[str] = None,
         in_reply_to: Optional[str] = None,
-        references: Optional[str] = None
+        references: Optional[str] = None,
+        **kwargs
     ) -> Dict:
         """Send email via Gmail"""
-        from email.mime.text import MIMEText
-        from email.mime.multipart import MIMEMultipart
-        
         service = self._get_service(access_token)
         
-        # Create message
-        message = MIMEMultipart('alternative')
-        message['To'] = ', '.join(to)
-        message['Subject'] = subject
-        
-        if in_reply_to:
-            message['In-Reply-To'] = in_reply_to
-        if references:
-            message['References'] = references
-        
-        if body_text:
-            message.attach(MIMEText(body_text, 'plain'))
-        if body_html:
-            message.attach(MIMEText(body_html, 'html'))
-        
         # Encode message
-        raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
+        message = build_mime_message(to, subject, body_html, body_text, in_reply_to, references)
+        raw = pybase64.urlsafe_b64encode(message).decode()
         
         # Send
-        result = service.users().messages().send(
+        result = await self._execute(access_token, service.users().messages().send(
             userId='me',
             body={'raw': raw}
-        ).execute()
+        ), COST_SEND)
         
         return result
 
@@ -1,25 +1,65 @@
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
+import logging
+import queue
+import httpx
 from src.config import settings
-from src.database import engine, Base
+from src.database import warm_pool
 from src.api.v1 import auth, accounts, messages, oauth
+from src.services.gmail import gmail_service
+from src.services.outlook import outlook_service
+
+logger = logging.getLogger(__name__)
+
+
+def start_log_listener() -> QueueListener:
+    """Route root log records through a queue so handler I/O happens on a background thread"""
+    root = logging.getLogger()
+    handlers = root.handlers or [logging.StreamHandler()]
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    root.handlers = [QueueHandler(log_queue)]
+    listener.start()
+    return listener
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    print("Starting up Unified Inbox API...")
+    listener = start_log_listener()
+    logger.info("Starting up Unified Inbox API...")
+    try:
+        await warm_pool()
+    except Exception:
+        # Connections will be opened on demand instead
+        logger.exception("Could not warm database pool")
+    # One pooled HTTP/2 client keeps provider connections alive across requests
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        timeout=30
+    )
+    gmail_service.set_client(app.state.http)
+    outlook_service.set_client(app.state.http)
     yield
     # Shutdown
-    print("Shutting down...")
+    logger.info("Shutting down...")
+    gmail_service.set_client(None)
+    outlook_service.set_client(None)
+    await app.state.http.aclose()
+    listener.stop()
+    logging.getLogger().handlers = list(listener.handlers)
 
 
 app = FastAPI(
     title="Unified Inbox API",
     description="Self-hosted unified inbox for Gmail and Outlook",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # CORS configuration
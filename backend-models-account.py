@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Text, Enum, JSON
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Boolean, ForeignKey, Text, Enum, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from src.database import Base
@@ -10,22 +10,41 @@ class EmailProvider(str, enum.Enum):
     OUTLOOK = "outlook"
 
 
+# Stored by value ('gmail'), matching the emailprovider type the migrations create
+PROVIDER_ENUM = Enum(
+    EmailProvider,
+    name='emailprovider',
+    values_callable=lambda members: [m.value for m in members]
+)
+
+
 class EmailAccount(Base):
     __tablename__ = "email_accounts"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
-    provider = Column(Enum(EmailProvider), nullable=False)
+    provider = Column(PROVIDER_ENUM, nullable=False)
     email_address = Column(String, nullable=False, index=True)
     display_name = Column(String)
     access_token = Column(Text)
     encrypted_refresh_token = Column(Text)
     token_expiry = Column(DateTime(timezone=True))
-    sync_state = Column(JSON, default={})  # Stores historyId for Gmail, deltaLink for Outlook
+    gmail_history_id = Column(BigInteger)  # Gmail history position for incremental sync
+    outlook_delta_link = Column(Text)  # Graph delta link for incremental sync
     last_synced_at = Column(DateTime(timezone=True))
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
+    __table_args__ = (
+        UniqueConstraint('user_id', 'email_address', 'provider', name='uq_email_accounts_user_email_provider'),
+        Index(
+            'ix_email_accounts_active',
+            last_synced_at.nulls_first(),
+            postgresql_include=['id'],
+            postgresql_where=(is_active == True)
+        ),
+    )
+    
     # Relationships
     user = relationship("User", back_populates="email_accounts")
     threads = relationship("Thread", back_populates="account", cascade="all, delete-orphan")
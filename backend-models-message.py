@@ -1,36 +1,91 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Text, JSON
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Text, Index, LargeBinary
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from src.database import Base
+from src.models.email_account import PROVIDER_ENUM
+import zstandard
+
+# HTML bodies compress 5-10x; the shared contexts are not thread-safe, so use them
+# only on the asyncio event loop thread (never from to_thread or executor workers)
+_ZSTD_ENC = zstandard.ZstdCompressor(level=3)
+_ZSTD_DEC = zstandard.ZstdDecompressor()
+
+
+def compress_body(body: str) -> bytes:
+    """Compress a message body for storage in message_bodies"""
+    return _ZSTD_ENC.compress(body.encode('utf-8')) if body is not None else None
 
 
 class Message(Base):
     __tablename__ = "messages"
 
-    id = Column(Integer, primary_key=True, index=True)
-    thread_id = Column(Integer, ForeignKey("threads.id", ondelete="CASCADE"), nullable=False, index=True)
+    id = Column(Integer, primary_key=True)
+    thread_id = Column(Integer, ForeignKey("threads.id", ondelete="CASCADE"), nullable=False)
     provider_message_id = Column(String, nullable=False, unique=True, index=True)
     from_addr = Column(String, nullable=False)
-    to_addrs = Column(JSON, default=[])
-    cc_addrs = Column(JSON, default=[])
-    bcc_addrs = Column(JSON, default=[])
+    to_addrs = Column(ARRAY(String), default=[])
+    cc_addrs = Column(ARRAY(String), default=[])
+    bcc_addrs = Column(ARRAY(String), default=[])
     subject = Column(Text)
-    date = Column(DateTime(timezone=True), index=True)
-    body_text = Column(Text)
-    body_html = Column(Text)
+    date = Column(DateTime(timezone=True))
     has_attachments = Column(Boolean, default=False)
     is_read = Column(Boolean, default=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
+    # Denormalized from thread/account so the inbox needs no joins
+    account_id = Column(Integer, ForeignKey("email_accounts.id", ondelete="CASCADE"), nullable=False)
+    account_email = Column(String)
+    provider = Column(PROVIDER_ENUM)
+    thread_snippet = Column(Text)  # Kept in sync by the trg_threads_snippet trigger
+    
+    __table_args__ = (
+        Index('ix_messages_thread_date', thread_id, date.desc()),
+        Index('ix_messages_account_date', account_id, date.desc()),
+        Index('ix_messages_to_addrs_gin', to_addrs, postgresql_using='gin'),
+        Index('ix_messages_cc_addrs_gin', cc_addrs, postgresql_using='gin'),
+    )
+    
     # Relationships
     thread = relationship("Thread", back_populates="messages")
     attachments = relationship("Attachment", back_populates="message", cascade="all, delete-orphan")
+    # Never loaded implicitly; request it with joinedload/selectinload(Message.body)
+    body = relationship("MessageBody", back_populates="message", uselist=False, cascade="all, delete-orphan", lazy="noload")
+    
+    @property
+    def body_text(self):
+        return self.body.body_text if self.body else None
+    
+    @property
+    def body_html(self):
+        return self.body.body_html if self.body else None
+
+
+class MessageBody(Base):
+    __tablename__ = "message_bodies"
+
+    message_id = Column(Integer, ForeignKey("messages.id", ondelete="CASCADE"), primary_key=True)
+    body_text = Column(Text)
+    body_html_zstd = Column(LargeBinary)  # zstd-compressed UTF-8
+    
+    @property
+    def body_html(self):
+        if self.body_html_zstd is None:
+            return None
+        return _ZSTD_DEC.decompress(self.body_html_zstd).decode('utf-8')
+    
+    @body_html.setter
+    def body_html(self, value):
+        self.body_html_zstd = compress_body(value)
+    
+    # Relationships
+    message = relationship("Message", back_populates="body")
 
 
 class Attachment(Base):
     __tablename__ = "attachments"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     message_id = Column(Integer, ForeignKey("messages.id", ondelete="CASCADE"), nullable=False, index=True)
     filename = Column(String, nullable=False)
     size = Column(Integer)
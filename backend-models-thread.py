@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from src.database import Base
@@ -7,14 +7,23 @@ from src.database import Base
 class Thread(Base):
     __tablename__ = "threads"
 
-    id = Column(Integer, primary_key=True, index=True)
-    account_id = Column(Integer, ForeignKey("email_accounts.id", ondelete="CASCADE"), nullable=False, index=True)
+    id = Column(Integer, primary_key=True)
+    account_id = Column(Integer, ForeignKey("email_accounts.id", ondelete="CASCADE"), nullable=False)
     provider_thread_id = Column(String, nullable=False, index=True)
     subject = Column(Text)
     snippet = Column(Text)
-    last_message_at = Column(DateTime(timezone=True), index=True)
+    last_message_at = Column(DateTime(timezone=True))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
+    __table_args__ = (
+        Index('ix_threads_account_last_msg', account_id, last_message_at.desc()),
+    )
+    
     # Relationships
     account = relationship("EmailAccount", back_populates="threads")
-    messages = relationship("Message", back_populates="thread", cascade="all, delete-orphan")
+    messages = relationship(
+        "Message",
+        back_populates="thread",
+        cascade="all, delete-orphan",
+        order_by="Message.date"
+    )
@@ -1,8 +1,33 @@
-from datetime import datetime
+import asyncio
+import weakref
+from datetime import datetime, timezone
+from contextlib import asynccontextmanager
 from typing import Optional, List, Dict
+from urllib.parse import quote, urlencode
+from aiolimiter import AsyncLimiter
+from cachetools import TTLCache
 import httpx
+import orjson
+try:
+    from ciso8601 import parse_datetime
+except ImportError:
+    # Python 3.11+ fromisoformat accepts the trailing 'Z' Graph uses
+    parse_datetime = datetime.fromisoformat
 from src.config import settings
 
+# Only the fields parse_message reads
+MESSAGE_SELECT = ','.join([
+    'id', 'conversationId', 'from', 'toRecipients', 'ccRecipients', 'bccRecipients',
+    'subject', 'receivedDateTime', 'sentDateTime', 'body', 'bodyPreview', 'hasAttachments'
+])
+ATTACHMENT_EXPAND = 'attachments($select=id,name,contentType,size)'
+
+# Graph allows 10,000 requests per 10 minutes per mailbox. The limiter spreads that
+# evenly (about 16/s) instead of allowing the whole window as one burst.
+GRAPH_REQUESTS_PER_WINDOW = 10000
+GRAPH_WINDOW_SECONDS = 600
+GRAPH_REQUESTS_PER_SECOND = GRAPH_REQUESTS_PER_WINDOW / GRAPH_WINDOW_SECONDS
+
 
 class OutlookService:
     def __init__(self):
@@ -11,24 +36,52 @@ class OutlookService:
         self.redirect_uri = settings.MS_REDIRECT_URI
         self.tenant = settings.MS_TENANT
         self.scopes = ['Mail.Read', 'Mail.Send', 'offline_access']
-    
-    def get_authorization_url(self, state: str) -> str:
-        """Generate OAuth authorization URL"""
-        scope_str = ' '.join(self.scopes)
-        params = {
+        # Everything but state is fixed, so encode it once
+        self._auth_url_base = f'https://login.microsoftonline.com/{self.tenant}/oauth2/v2.0/authorize?' + urlencode({
             'client_id': self.client_id,
             'response_type': 'code',
             'redirect_uri': self.redirect_uri,
-            'scope': scope_str,
-            'state': state,
+            'scope': ' '.join(self.scopes),
             'response_mode': 'query'
-        }
-        query = '&'.join([f'{k}={v}' for k, v in params.items()])
-        return f'https://login.microsoftonline.com/{self.tenant}/oauth2/v2.0/authorize?{query}'
+        })
+        self._client: Optional[httpx.AsyncClient] = None
+        # One limiter per mailbox, keyed by its current access token. Limiters are
+        # bound to an event loop, so each loop (one per Celery task) gets its own cache.
+        self._limiters = weakref.WeakKeyDictionary()
+    
+    def set_client(self, client: Optional[httpx.AsyncClient]):
+        """Use a shared, pooled HTTP client (set by the API lifespan)"""
+        self._client = client
+    
+    @asynccontextmanager
+    async def _http(self, http: Optional[httpx.AsyncClient] = None):
+        """Yield the caller's client, the shared one, or a short-lived one"""
+        if http is not None:
+            yield http
+        elif self._client is not None:
+            yield self._client
+        else:
+            async with httpx.AsyncClient() as client:
+                yield client
+    
+    def _limiter(self, access_token: str) -> AsyncLimiter:
+        """Token bucket holding the mailbox under Graph's throttling limit"""
+        loop = asyncio.get_running_loop()
+        limiters = self._limiters.get(loop)
+        if limiters is None:
+            limiters = self._limiters[loop] = TTLCache(maxsize=10000, ttl=3600)
+        limiter = limiters.get(access_token)
+        if limiter is None:
+            limiter = limiters[access_token] = AsyncLimiter(GRAPH_REQUESTS_PER_SECOND, 1)
+        return limiter
+    
+    def get_authorization_url(self, state: str) -> str:
+        """Generate OAuth authorization URL"""
+        return f'{self._auth_url_base}&state={quote(state, safe="")}'
     
     async def exchange_code_for_tokens(self, code: str) -> Dict:
         """Exchange authorization code for access and refresh tokens"""
-        async with httpx.AsyncClient() as client:
+        async with self._http() as client:
             response = await client.post(
                 f'https://login.microsoftonline.com/{self.tenant}/oauth2/v2.0/token',
                 data={
@@ -41,11 +94,11 @@ class OutlookService:
                 }
             )
             response.raise_for_status()
-            return response.json()
+            return orjson.loads(response.content)
     
-    async def refresh_access_token(self, refresh_token: str) -> Dict:
+    async def refresh_access_token(self, refresh_token: str, http: Optional[httpx.AsyncClient] = None) -> Dict:
         """Refresh access token using refresh token"""
-        async with httpx.AsyncClient() as client:
+        async with self._http(http) as client:
             response = await client.post(
                 f'https://login.microsoftonline.com/{self.tenant}/oauth2/v2.0/token',
                 data={
@@ -57,26 +110,30 @@ class OutlookService:
                 }
             )
             response.raise_for_status()
-            return response.json()
+            return orjson.loads(response.content)
     
     async def get_user_profile(self, access_token: str) -> Dict:
         """Get user's email address and profile info"""
-        async with httpx.AsyncClient() as client:
+        await self._limiter(access_token).acquire()
+        async with self._http() as client:
             response = await client.get(
                 'https://graph.microsoft.com/v1.0/me',
                 headers={'Authorization': f'Bearer {access_token}'}
             )
             response.raise_for_status()
-            return response.json()
+            return orjson.loads(response.content)
     
     async def fetch_messages(
         self,
         access_token: str,
         max_results: int = 50,
-        delta_link: Optional[str] = None
+        delta_link: Optional[str] = None,
+        expand_attachments: bool = False,
+        http: Optional[httpx.AsyncClient] = None
     ) -> Dict:
         """Fetch messages from Outlook"""
-        async with httpx.AsyncClient() as client:
+        await self._limiter(access_token).acquire()
+        async with self._http(http) as client:
             if delta_link:
                 # Incremental sync using delta
                 response = await client.get(
@@ -84,14 +141,20 @@ class OutlookService:
                     headers={'Authorization': f'Bearer {access_token}'}
                 )
             else:
-                # Full sync - get recent messages
+                # Full sync - get recent messages (the delta link keeps these options)
+                url = (
+                    'https://graph.microsoft.com/v1.0/me/mailFolders/Inbox/messages/delta'
+                    f'?$top={max_results}&$select={MESSAGE_SELECT}'
+                )
+                if expand_attachments:
+                    url += f'&$expand={ATTACHMENT_EXPAND}'
                 response = await client.get(
-                    f'https://graph.microsoft.com/v1.0/me/mailFolders/Inbox/messages/delta?$top={max_results}',
+                    url,
                     headers={'Authorization': f'Bearer {access_token}'}
                 )
             
             response.raise_for_status()
-            data = response.json()
+            data = orjson.loads(response.content)
             
             return {
                 'messages': data.get('value', []),
@@ -104,9 +167,9 @@ class OutlookService:
         # Parse date
         date_str = message.get('receivedDateTime', message.get('sentDateTime', ''))
         try:
-            date = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
+            date = parse_datetime(date_str)
         except:
-            date = datetime.utcnow()
+            date = datetime.now(timezone.utc)
         
         # Extract recipients
         to_addrs = [r['emailAddress']['address'] for r in message.get('toRecipients', [])]
@@ -118,13 +181,11 @@ class OutlookService:
         
         # Extract body
         body_obj = message.get('body', {})
-        body_html = '' if body_obj.get('contentType') == 'html' else ''
-        body_text = '' if body_obj.get('contentType') == 'text' else ''
-        
-        if body_obj.get('contentType') == 'html':
-            body_html = body_obj.get('content', '')
+        content = body_obj.get('content', '')
+        if body_obj.get('contentType', '').lower() == 'html':
+            body_html, body_text = content, ''
         else:
-            body_text = body_obj.get('content', '')
+            body_html, body_text = '', content
         
         # Extract attachments
         attachments = []
@@ -163,9 +224,10 @@ class OutlookService:
         subject: str,
         body_html: Optional[str] = None,
         body_text: Optional[str] = None,
-        in_reply_to: Optional[str] = None
+        in_reply_to: Optional[str] = None,
+        **kwargs
     ) -> Dict:
-        """Send email via Outlook"""
+        """Send email via Outlook (Graph threads replies itself, so references is ignored)"""
         # Prepare message body
         body_content = body_html if body_html else body_text
         content_type = 'HTML' if body_html else 'Text'
@@ -183,7 +245,8 @@ class OutlookService:
             }
         }
         
-        async with httpx.AsyncClient() as client:
+        await self._limiter(access_token).acquire()
+        async with self._http() as client:
             if in_reply_to:
                 # Reply to existing message
                 response = await client.post(
@@ -192,7 +255,7 @@ class OutlookService:
                         'Authorization': f'Bearer {access_token}',
                         'Content-Type': 'application/json'
                     },
-                    json={'comment': body_content}
+                    content=orjson.dumps({'comment': body_content})
                 )
             else:
                 # Send new message
@@ -202,7 +265,7 @@ class OutlookService:
                         'Authorization': f'Bearer {access_token}',
                         'Content-Type': 'application/json'
                     },
-                    json=message_data
+                    content=orjson.dumps(message_data)
                 )
             
             response.raise_for_status()
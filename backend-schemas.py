@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, ConfigDict, EmailStr, Field
 from typing import Optional, List
 from datetime import datetime
 from enum import Enum
@@ -33,8 +33,7 @@ class User(UserBase):
     role: UserRole
     created_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 # Auth Schemas
@@ -65,8 +64,7 @@ class EmailAccount(EmailAccountBase):
     last_synced_at: Optional[datetime] = None
     created_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 # Message Schemas
@@ -77,8 +75,7 @@ class AttachmentSchema(BaseModel):
     mime_type: Optional[str] = None
     provider_attachment_id: str
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class MessageSchema(BaseModel):
@@ -89,15 +86,14 @@ class MessageSchema(BaseModel):
     cc_addrs: List[str] = []
     bcc_addrs: List[str] = []
     subject: Optional[str] = None
-    date: datetime
+    date: Optional[datetime] = None
     body_text: Optional[str] = None
     body_html: Optional[str] = None
     has_attachments: bool
     is_read: bool
     attachments: List[AttachmentSchema] = []
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class ThreadSchema(BaseModel):
@@ -109,8 +105,7 @@ class ThreadSchema(BaseModel):
     last_message_at: datetime
     messages: List[MessageSchema] = []
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class InboxMessageSchema(BaseModel):
@@ -122,12 +117,16 @@ class InboxMessageSchema(BaseModel):
     from_addr: str
     subject: Optional[str] = None
     snippet: Optional[str] = None
-    date: datetime
+    date: Optional[datetime] = None
     has_attachments: bool
     is_read: bool
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
+
+
+class InboxPage(BaseModel):
+    messages: List[InboxMessageSchema]
+    next_cursor: Optional[str] = None
 
 
 # Send Message Schema
@@ -1,18 +1,67 @@
-from celery import Task
-from datetime import datetime, timedelta
-from sqlalchemy import select, and_
-from sqlalchemy.orm import selectinload
+from celery import Task, group
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, and_, insert, update, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import load_only, raiseload
+from sqlalchemy.orm.attributes import set_committed_value
 import asyncio
+import logging
+import httpx
 from src.tasks.celery_app import celery_app
 from src.database import AsyncSessionLocal
+# Imported so EmailAccount.user resolves when the worker configures mappers
+from src.models.user import User
 from src.models.email_account import EmailAccount, EmailProvider
 from src.models.thread import Thread
-from src.models.message import Message
+from src.models.message import Message, MessageBody, Attachment, compress_body
 from src.services.gmail import gmail_service
 from src.services.outlook import outlook_service
 from src.services.encryption import encryption_service
 from src.config import settings
-import time
+
+logger = logging.getLogger(__name__)
+
+# Column order used for bulk message inserts (COPY and multi-row INSERT)
+MESSAGE_COLUMNS = [
+    'thread_id', 'provider_message_id', 'from_addr', 'to_addrs', 'cc_addrs', 'bcc_addrs',
+    'subject', 'date', 'has_attachments', 'is_read',
+    'account_id', 'account_email', 'provider', 'thread_snippet'
+]
+
+# Batches at least this large (a full fetch page) are written with COPY instead of INSERT
+COPY_THRESHOLD = 50
+
+# COPY cannot skip conflicts, so large batches go through a staging table.
+# It holds only the copied columns: no id, so staged rows don't draw sequence values.
+_MESSAGE_COLUMN_LIST = ', '.join(MESSAGE_COLUMNS)
+_CREATE_STAGING_SQL = text(
+    "CREATE TEMP TABLE IF NOT EXISTS messages_staging ON COMMIT DELETE ROWS AS "
+    f"SELECT {_MESSAGE_COLUMN_LIST} FROM messages WITH NO DATA"
+)
+_MERGE_STAGING_SQL = text(
+    f"INSERT INTO messages ({_MESSAGE_COLUMN_LIST}) "
+    f"SELECT {_MESSAGE_COLUMN_LIST} FROM messages_staging "
+    "ON CONFLICT (provider_message_id) DO NOTHING "
+    "RETURNING provider_message_id, id"
+)
+
+# Per-account transaction lock so concurrent tasks don't all refresh the same token
+_TRY_REFRESH_LOCK_SQL = text("SELECT pg_try_advisory_xact_lock(hashtext(:k))")
+_WAIT_REFRESH_LOCK_SQL = text("SELECT pg_advisory_xact_lock(hashtext(:k))")
+_TOKEN_ATTRIBUTES = ['access_token', 'token_expiry', 'encrypted_refresh_token', 'is_active']
+
+# Account columns read during a sync; bookkeeping is written back with a Core UPDATE
+_SYNC_COLUMNS = load_only(
+    EmailAccount.id,
+    EmailAccount.provider,
+    EmailAccount.email_address,
+    EmailAccount.is_active,
+    EmailAccount.access_token,
+    EmailAccount.token_expiry,
+    EmailAccount.encrypted_refresh_token,
+    EmailAccount.gmail_history_id,
+    EmailAccount.outlook_delta_link
+)
 
 
 class DatabaseTask(Task):
@@ -23,7 +72,17 @@ class DatabaseTask(Task):
         return AsyncSessionLocal()
 
 
-@celery_app.task(bind=True, base=DatabaseTask, max_retries=3)
+@celery_app.task(
+    bind=True,
+    base=DatabaseTask,
+    max_retries=3,
+    ignore_result=True,
+    # Exponential backoff with jitter so failed syncs don't retry in lockstep
+    autoretry_for=(Exception,),
+    retry_backoff=60,
+    retry_backoff_max=3600,
+    retry_jitter=True
+)
 def sync_account_task(self, account_id: int):
     """Sync a single email account"""
     return asyncio.run(sync_account_async(account_id))
@@ -31,11 +90,20 @@ def sync_account_task(self, account_id: int):
 
 async def sync_account_async(account_id: int):
     """Async function to sync account"""
-    async with AsyncSessionLocal() as db:
+    # One pooled client per task so token refresh and fetches share connections
+    async with AsyncSessionLocal() as db, httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=50),
+        timeout=30
+    ) as http:
+        # One timestamp for the whole run: token check and last_synced_at
+        now = datetime.now(timezone.utc)
         try:
-            # Get account
+            # Get account; only the columns the sync reads, and no relationship lazy loads
             result = await db.execute(
-                select(EmailAccount).where(EmailAccount.id == account_id)
+                select(EmailAccount)
+                .options(_SYNC_COLUMNS, raiseload('*'))
+                .where(EmailAccount.id == account_id)
             )
             account = result.scalar_one_or_none()
             
@@ -43,47 +111,68 @@ async def sync_account_async(account_id: int):
                 return {'status': 'skipped', 'reason': 'account not found or inactive'}
             
             # Check if token needs refresh
-            if account.token_expiry and account.token_expiry < datetime.utcnow():
-                await refresh_token(account, db)
+            if account.token_expiry and account.token_expiry < now:
+                await refresh_token(account, db, http)
             
             # Fetch messages based on provider
+            sync_state = None
+            has_more = False
             if account.provider == EmailProvider.GMAIL:
-                await sync_gmail_account(account, db)
+                sync_state, has_more = await sync_gmail_account(account, db)
             elif account.provider == EmailProvider.OUTLOOK:
-                await sync_outlook_account(account, db)
+                sync_state = await sync_outlook_account(account, db, http)
             
-            # Update last synced time
-            account.last_synced_at = datetime.utcnow()
+            # One UPDATE for the sync bookkeeping instead of an ORM flush
+            values = {'last_synced_at': now}
+            if sync_state is not None:
+                values.update(sync_state)
+            await db.execute(
+                update(EmailAccount).where(EmailAccount.id == account_id).values(**values)
+            )
             await db.commit()
             
+            # A full page means history is left over; continue from the stored position
+            if has_more:
+                sync_account_task.apply_async(args=[account_id], countdown=1)
+            
             return {'status': 'success', 'account_id': account_id}
         
-        except Exception as e:
-            print(f"Error syncing account {account_id}: {str(e)}")
+        except Exception:
+            logger.exception("sync error account=%s", account_id)
             await db.rollback()
-            # Exponential backoff
-            raise self.retry(exc=e, countdown=2 ** self.request.retries * 60)
+            # The task decorator schedules the retry
+            raise
 
 
-async def refresh_token(account: EmailAccount, db):
+async def refresh_token(account: EmailAccount, db, http: httpx.AsyncClient = None):
     """Refresh access token"""
     if not account.encrypted_refresh_token:
         account.is_active = False
         return
     
+    # The lock is released by the commit that stores the new token
+    lock_key = {'k': f'refresh:{account.id}'}
+    if not (await db.execute(_TRY_REFRESH_LOCK_SQL, lock_key)).scalar():
+        # Another worker is refreshing; wait for its commit and use its token
+        await db.execute(_WAIT_REFRESH_LOCK_SQL, lock_key)
+        await db.refresh(account, _TOKEN_ATTRIBUTES)
+        if account.token_expiry and account.token_expiry > datetime.now(timezone.utc):
+            await db.commit()
+            return
+    
     try:
-        refresh_token = encryption_service.decrypt(account.encrypted_refresh_token)
+        refresh_token = encryption_service.decrypt_cached(account.encrypted_refresh_token)
         
         if account.provider == EmailProvider.GMAIL:
-            tokens = await gmail_service.refresh_access_token(refresh_token)
+            tokens = await gmail_service.refresh_access_token(refresh_token, http=http)
         elif account.provider == EmailProvider.OUTLOOK:
-            tokens = await outlook_service.refresh_access_token(refresh_token)
+            tokens = await outlook_service.refresh_access_token(refresh_token, http=http)
         else:
             return
         
         account.access_token = tokens['access_token']
         expires_in = tokens.get('expires_in', 3600)
-        account.token_expiry = datetime.utcnow() + timedelta(seconds=expires_in)
+        account.token_expiry = datetime.now(timezone.utc) + timedelta(seconds=expires_in)
         
         # Update refresh token if new one provided
         if 'refresh_token' in tokens:
@@ -91,215 +180,282 @@ async def refresh_token(account: EmailAccount, db):
         
         await db.commit()
     
-    except Exception as e:
-        print(f"Failed to refresh token for account {account.id}: {str(e)}")
+    except Exception:
+        logger.exception("token refresh failed account=%s", account.id)
         account.is_active = False
         await db.commit()
 
 
 async def sync_gmail_account(account: EmailAccount, db):
-    """Sync Gmail account"""
+    """Sync Gmail account; returns (sync column values or None, whether history remains)"""
     try:
         # Get sync state
-        sync_state = account.sync_state or {}
-        history_id = sync_state.get('history_id')
+        history_id = account.gmail_history_id
         
         # Fetch messages
         result = await gmail_service.fetch_messages(
             access_token=account.access_token,
             max_results=settings.MAX_MESSAGES_PER_ACCOUNT,
-            history_id=history_id
+            history_id=str(history_id) if history_id else None
         )
         
         if result['type'] == 'full':
             # Process full sync
-            for msg_data in result.get('messages', []):
-                await process_gmail_message(msg_data, account, db)
+            await sync_gmail_pages(result.get('message_ids', []), account, db)
             
             # Update history_id
             if result.get('history_id'):
-                account.sync_state = {'history_id': result['history_id']}
+                return {'gmail_history_id': int(result['history_id'])}, False
         
         elif result['type'] == 'history':
             # Process incremental sync
             history = result.get('data', {})
-            for history_record in history.get('history', []):
-                for msg in history_record.get('messagesAdded', []):
-                    # Fetch full message
-                    # In production, batch these requests
-                    pass
+            message_ids = added_inbox_message_ids(history)
+            
+            await sync_gmail_pages(message_ids, account, db)
+            
+            # The page size tells us whether to continue; no follow-up probe needed
+            records = history.get('history', [])
+            if len(records) >= settings.MAX_MESSAGES_PER_ACCOUNT:
+                return {'gmail_history_id': int(records[-1]['id'])}, True
+            if history.get('historyId'):
+                return {'gmail_history_id': int(history['historyId'])}, False
         
-        await db.commit()
+        return None, False
     
     except Exception as e:
-        print(f"Gmail sync error for account {account.id}: {str(e)}")
+        logger.error("gmail sync error account=%s: %s", account.id, e)
         raise
 
 
-async def process_gmail_message(msg_data: dict, account: EmailAccount, db):
-    """Process and store Gmail message"""
-    parsed = gmail_service.parse_message(msg_data)
+def parse_messages(parse, messages: list) -> list:
+    """Parse a page of provider messages; run in a worker thread to keep the loop free"""
+    return [parse(m) for m in messages]
+
+
+async def sync_gmail_pages(message_ids: list, account: EmailAccount, db):
+    """Fetch and store Gmail messages one batch page at a time"""
+    async for messages in gmail_service.iter_messages(account.access_token, message_ids):
+        parsed_list = await asyncio.to_thread(parse_messages, gmail_service.parse_message, messages)
+        await sync_parsed_messages(parsed_list, account, db)
+        # Commit per page so neither memory nor the transaction grows with the sync
+        await db.commit()
+
+
+def added_inbox_message_ids(history: dict) -> list:
+    """Ids of messages added to the inbox in a history.list response, in order and deduplicated"""
+    message_ids = {}
+    for history_record in history.get('history', []):
+        for added in history_record.get('messagesAdded', []):
+            message = added['message']
+            if 'INBOX' in message.get('labelIds', []):
+                message_ids[message['id']] = None
+    return list(message_ids)
+
+
+async def sync_parsed_messages(parsed_list: list, account: EmailAccount, db):
+    """Store parsed provider messages with a fixed number of queries"""
+    if not parsed_list:
+        return
     
-    # Check if message already exists
-    result = await db.execute(
-        select(Message).where(Message.provider_message_id == parsed['provider_message_id'])
-    )
-    if result.scalar_one_or_none():
-        return  # Already synced
+    # No existence check: messages already stored are skipped by ON CONFLICT DO NOTHING
+    threads = await get_or_create_threads(parsed_list, account, db)
     
-    # Get or create thread
+    # Queue message rows for bulk insert
+    pending = [
+        (build_message_row(parsed, threads[parsed['thread_id']], account), parsed)
+        for parsed in parsed_list
+    ]
+    await store_messages(pending, db)
+
+
+async def get_or_create_threads(parsed_list: list, account: EmailAccount, db) -> dict:
+    """Load or create the threads of parsed messages, returning {provider_thread_id: Thread}"""
+    # Only the columns the sync compares or copies into message rows
     result = await db.execute(
-        select(Thread).where(
+        select(Thread)
+        .options(load_only(Thread.id, Thread.provider_thread_id, Thread.snippet, Thread.last_message_at))
+        .where(
             and_(
                 Thread.account_id == account.id,
-                Thread.provider_thread_id == parsed['thread_id']
+                Thread.provider_thread_id.in_({p['thread_id'] for p in parsed_list})
             )
         )
     )
-    thread = result.scalar_one_or_none()
+    threads = {thread.provider_thread_id: thread for thread in result.scalars()}
+    
+    # Newest (date, snippet) per existing thread, written back in one UPDATE
+    thread_updates = {}
+    for parsed in parsed_list:
+        thread = threads.get(parsed['thread_id'])
+        if not thread:
+            thread = Thread(
+                account_id=account.id,
+                provider_thread_id=parsed['thread_id'],
+                subject=parsed['subject'],
+                snippet=parsed['snippet'],
+                last_message_at=parsed['date']
+            )
+            db.add(thread)
+            threads[parsed['thread_id']] = thread
+        elif parsed['date'] > thread.last_message_at:
+            # Keep the instance current without marking it dirty for the flush
+            set_committed_value(thread, 'last_message_at', parsed['date'])
+            set_committed_value(thread, 'snippet', parsed['snippet'])
+            # Threads created in this batch have no id yet; their INSERT carries the values
+            if thread.id is not None:
+                thread_updates[thread.id] = (parsed['date'], parsed['snippet'])
     
-    if not thread:
-        thread = Thread(
-            account_id=account.id,
-            provider_thread_id=parsed['thread_id'],
-            subject=parsed['subject'],
-            snippet=parsed['snippet'],
-            last_message_at=parsed['date']
+    # New threads are inserted together and get their ids here
+    await db.flush()
+    if thread_updates:
+        await update_threads(thread_updates, db)
+    return threads
+
+
+async def update_threads(thread_updates: dict, db):
+    """Apply {thread_id: (last_message_at, snippet)} with a single UPDATE ... FROM (VALUES ...)"""
+    values_clause = []
+    params = {}
+    for i, (thread_id, (date, snippet)) in enumerate(thread_updates.items()):
+        # Casts give the VALUES columns their types; bare parameters would be text
+        values_clause.append(
+            f"(CAST(:id_{i} AS integer), CAST(:d_{i} AS timestamptz), CAST(:s_{i} AS text))"
         )
-        db.add(thread)
-        await db.flush()
-    else:
-        # Update thread
-        if parsed['date'] > thread.last_message_at:
-            thread.last_message_at = parsed['date']
-            thread.snippet = parsed['snippet']
+        params[f'id_{i}'] = thread_id
+        params[f'd_{i}'] = date
+        params[f's_{i}'] = snippet
     
-    # Create message
-    message = Message(
-        thread_id=thread.id,
-        provider_message_id=parsed['provider_message_id'],
-        from_addr=parsed['from_addr'],
-        to_addrs=parsed['to_addrs'],
-        cc_addrs=parsed.get('cc_addrs', []),
-        subject=parsed['subject'],
-        date=parsed['date'],
-        body_text=parsed.get('body_text'),
-        body_html=parsed.get('body_html'),
-        has_attachments=parsed['has_attachments']
+    await db.execute(
+        text(
+            "UPDATE threads SET last_message_at = v.d, snippet = v.s "
+            f"FROM (VALUES {', '.join(values_clause)}) AS v(id, d, s) "
+            "WHERE threads.id = v.id"
+        ),
+        params
     )
-    db.add(message)
-    await db.flush()
+
+
+def build_message_row(parsed: dict, thread: Thread, account: EmailAccount) -> dict:
+    """Build a messages row from a parsed provider message"""
+    return {
+        'thread_id': thread.id,
+        'provider_message_id': parsed['provider_message_id'],
+        'from_addr': parsed['from_addr'],
+        'to_addrs': parsed['to_addrs'],
+        'cc_addrs': parsed.get('cc_addrs', []),
+        'bcc_addrs': parsed.get('bcc_addrs', []),
+        'subject': parsed['subject'],
+        'date': parsed['date'],
+        'has_attachments': parsed['has_attachments'],
+        'is_read': False,
+        'account_id': account.id,
+        'account_email': account.email_address,
+        'provider': account.provider,
+        'thread_snippet': thread.snippet
+    }
+
+
+async def bulk_insert_messages(session, rows: list) -> dict:
+    """Bulk insert message rows, returning {provider_message_id: id} for rows actually inserted"""
+    if not rows:
+        return {}
     
-    # Store attachments metadata
-    from src.models.message import Attachment
-    for att in parsed.get('attachments', []):
-        attachment = Attachment(
-            message_id=message.id,
-            filename=att['filename'],
-            size=att.get('size'),
-            mime_type=att.get('mime_type'),
-            provider_attachment_id=att['attachment_id']
+    if len(rows) >= COPY_THRESHOLD:
+        # COPY does permission/type checks once per batch instead of per row
+        await session.execute(_CREATE_STAGING_SQL)
+        await session.execute(text("TRUNCATE messages_staging"))
+        conn = await session.connection()
+        raw = await conn.get_raw_connection()
+        # COPY bypasses SQLAlchemy, so apply the column bind processors (e.g. the
+        # provider enum label) ourselves to match what the INSERT path writes
+        processors = [
+            (c, Message.__table__.c[c].type.bind_processor(conn.dialect))
+            for c in MESSAGE_COLUMNS
+        ]
+        await raw.driver_connection.copy_records_to_table(
+            'messages_staging',
+            records=[
+                tuple(process(r[c]) if process else r[c] for c, process in processors)
+                for r in rows
+            ],
+            columns=MESSAGE_COLUMNS
         )
-        db.add(attachment)
+        result = await session.execute(_MERGE_STAGING_SQL)
+    else:
+        result = await session.execute(
+            pg_insert(Message).values(rows)
+            .on_conflict_do_nothing(index_elements=['provider_message_id'])
+            .returning(Message.provider_message_id, Message.id)
+        )
+    
+    return dict(result.all())
 
 
-async def sync_outlook_account(account: EmailAccount, db):
-    """Sync Outlook account"""
+async def store_messages(pending: list, db):
+    """Bulk insert queued messages, their bodies and attachments metadata"""
+    message_ids = await bulk_insert_messages(db, [row for row, _ in pending])
+    
+    bodies = []
+    attachments = []
+    for row, parsed in pending:
+        message_id = message_ids.get(row['provider_message_id'])
+        if message_id is None:
+            continue  # Already stored; skipped by ON CONFLICT
+        bodies.append({
+            'message_id': message_id,
+            'body_text': parsed.get('body_text'),
+            'body_html_zstd': compress_body(parsed.get('body_html'))
+        })
+        
+        for att in parsed.get('attachments', []):
+            attachments.append({
+                'message_id': message_id,
+                'filename': att['filename'],
+                'size': att.get('size'),
+                'mime_type': att.get('mime_type'),
+                'provider_attachment_id': att['attachment_id']
+            })
+    
+    # executemany form: one prepared statement however many rows there are
+    if bodies:
+        await db.execute(insert(MessageBody), bodies)
+    if attachments:
+        await db.execute(insert(Attachment), attachments)
+
+
+async def sync_outlook_account(account: EmailAccount, db, http: httpx.AsyncClient = None):
+    """Sync Outlook account; returns the sync column values to store, if any"""
     try:
         # Get sync state
-        sync_state = account.sync_state or {}
-        delta_link = sync_state.get('delta_link')
+        delta_link = account.outlook_delta_link
         
         # Fetch messages
         result = await outlook_service.fetch_messages(
             access_token=account.access_token,
             max_results=settings.MAX_MESSAGES_PER_ACCOUNT,
-            delta_link=delta_link
+            delta_link=delta_link,
+            http=http
         )
         
         # Process messages
-        for msg_data in result.get('messages', []):
-            await process_outlook_message(msg_data, account, db)
+        parsed_list = await asyncio.to_thread(
+            parse_messages, outlook_service.parse_message, result.get('messages', [])
+        )
+        await sync_parsed_messages(parsed_list, account, db)
         
         # Update delta link
         if result.get('delta_link'):
-            account.sync_state = {'delta_link': result['delta_link']}
+            return {'outlook_delta_link': result['delta_link']}
         
-        await db.commit()
+        return None
     
     except Exception as e:
-        print(f"Outlook sync error for account {account.id}: {str(e)}")
+        logger.error("outlook sync error account=%s: %s", account.id, e)
         raise
 
 
-async def process_outlook_message(msg_data: dict, account: EmailAccount, db):
-    """Process and store Outlook message"""
-    parsed = outlook_service.parse_message(msg_data)
-    
-    # Check if message already exists
-    result = await db.execute(
-        select(Message).where(Message.provider_message_id == parsed['provider_message_id'])
-    )
-    if result.scalar_one_or_none():
-        return  # Already synced
-    
-    # Get or create thread
-    result = await db.execute(
-        select(Thread).where(
-            and_(
-                Thread.account_id == account.id,
-                Thread.provider_thread_id == parsed['thread_id']
-            )
-        )
-    )
-    thread = result.scalar_one_or_none()
-    
-    if not thread:
-        thread = Thread(
-            account_id=account.id,
-            provider_thread_id=parsed['thread_id'],
-            subject=parsed['subject'],
-            snippet=parsed['snippet'],
-            last_message_at=parsed['date']
-        )
-        db.add(thread)
-        await db.flush()
-    else:
-        # Update thread
-        if parsed['date'] > thread.last_message_at:
-            thread.last_message_at = parsed['date']
-            thread.snippet = parsed['snippet']
-    
-    # Create message
-    message = Message(
-        thread_id=thread.id,
-        provider_message_id=parsed['provider_message_id'],
-        from_addr=parsed['from_addr'],
-        to_addrs=parsed['to_addrs'],
-        cc_addrs=parsed.get('cc_addrs', []),
-        subject=parsed['subject'],
-        date=parsed['date'],
-        body_text=parsed.get('body_text'),
-        body_html=parsed.get('body_html'),
-        has_attachments=parsed['has_attachments']
-    )
-    db.add(message)
-    await db.flush()
-    
-    # Store attachments metadata
-    from src.models.message import Attachment
-    for att in parsed.get('attachments', []):
-        attachment = Attachment(
-            message_id=message.id,
-            filename=att['filename'],
-            size=att.get('size'),
-            mime_type=att.get('mime_type'),
-            provider_attachment_id=att['attachment_id']
-        )
-        db.add(attachment)
-
-
-@celery_app.task
+@celery_app.task(ignore_result=True)
 def sync_all_accounts():
     """Sync all active accounts"""
     return asyncio.run(sync_all_accounts_async())
@@ -308,14 +464,17 @@ def sync_all_accounts():
 async def sync_all_accounts_async():
     """Async function to sync all accounts"""
     async with AsyncSessionLocal() as db:
-        # Get all active accounts
+        # Get the least recently synced active accounts (served by ix_email_accounts_active)
         result = await db.execute(
-            select(EmailAccount).where(EmailAccount.is_active == True)
+            select(EmailAccount.id)
+            .where(EmailAccount.is_active == True)
+            .order_by(EmailAccount.last_synced_at.asc().nulls_first())
+            .limit(settings.SYNC_BATCH_SIZE)
         )
-        accounts = result.scalars().all()
+        account_ids = result.scalars().all()
         
-        # Trigger sync for each account
-        for account in accounts:
-            sync_account_task.delay(account.id)
+        # Publish all syncs together over one producer connection
+        if account_ids:
+            group(sync_account_task.s(account_id) for account_id in account_ids).apply_async()
         
-        return {'status': 'triggered', 'count': len(accounts)}
+        return {'status': 'triggered', 'count': len(account_ids)}
@@ -0,0 +1,88 @@
+import asyncio
+import time
+import weakref
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+from cachetools import TLRUCache
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.models.email_account import EmailAccount, EmailProvider
+from src.services.gmail import gmail_service
+from src.services.outlook import outlook_service
+from src.services.encryption import encryption_service
+
+# Refresh tokens this close to expiry instead of letting the provider reject them
+REFRESH_MARGIN = timedelta(seconds=60)
+
+# Upper bound on cached tokens per process
+TOKEN_CACHE_SIZE = 10000
+
+
+def _token_ttu(account_id: int, value: Tuple[str, datetime], now: float) -> float:
+    """Evict a cached token once it enters the refresh margin"""
+    remaining = value[1] - datetime.now(timezone.utc) - REFRESH_MARGIN
+    return now + remaining.total_seconds()
+
+
+class TokenManager:
+    """Hands out valid access tokens, refreshing at most once per account at a time"""
+
+    def __init__(self):
+        # Keyed by (event loop, account id): a lock only works on the loop that uses it.
+        # Weak values drop each lock once no refresh holds or waits on it.
+        self._locks = weakref.WeakValueDictionary()
+        self._cache = TLRUCache(maxsize=TOKEN_CACHE_SIZE, ttu=_token_ttu, timer=time.monotonic)
+
+    def _fresh(self, account_id: int, access_token: str, token_expiry: datetime) -> Optional[str]:
+        """Return the newest known token for the account if it is not about to expire"""
+        cached = self._cache.get(account_id)
+        if cached and (token_expiry is None or cached[1] > token_expiry):
+            access_token, token_expiry = cached
+        if token_expiry and token_expiry - datetime.now(timezone.utc) > REFRESH_MARGIN:
+            return access_token
+        return None
+
+    async def get_valid_token(self, account: EmailAccount, db: AsyncSession) -> str:
+        """Return a usable access token, refreshing and persisting it when stale"""
+        token = self._fresh(account.id, account.access_token, account.token_expiry)
+        if token:
+            return token
+
+        key = (asyncio.get_running_loop(), account.id)
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        async with lock:
+            # Another request may have refreshed while we waited
+            token = self._fresh(account.id, account.access_token, account.token_expiry)
+            if token:
+                return token
+            return await self._refresh(account, db)
+
+    async def _refresh(self, account: EmailAccount, db: AsyncSession) -> str:
+        """Refresh the access token with the provider and store it"""
+        if not account.encrypted_refresh_token:
+            raise ValueError("Account has no refresh token")
+
+        refresh_token = encryption_service.decrypt_cached(account.encrypted_refresh_token)
+        if account.provider == EmailProvider.GMAIL:
+            tokens = await gmail_service.refresh_access_token(refresh_token)
+        else:
+            tokens = await outlook_service.refresh_access_token(refresh_token)
+
+        access_token = tokens['access_token']
+        token_expiry = datetime.now(timezone.utc) + timedelta(seconds=tokens.get('expires_in', 3600))
+        values = {'access_token': access_token, 'token_expiry': token_expiry}
+        if 'refresh_token' in tokens:
+            values['encrypted_refresh_token'] = await encryption_service.encrypt_async(tokens['refresh_token'])
+
+        await db.execute(
+            update(EmailAccount).where(EmailAccount.id == account.id).values(**values)
+        )
+        await db.commit()
+
+        self._cache[account.id] = (access_token, token_expiry)
+        return access_token
+
+
+token_manager = TokenManager()
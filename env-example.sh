@@ -3,6 +3,11 @@ POSTGRES_USER=unifiedinbox
 POSTGRES_PASSWORD=change_this_to_a_strong_password_123!
 POSTGRES_DB=unifiedinbox
 
+# Database Connection Pool
+DB_POOL_SIZE=20
+DB_MAX_OVERFLOW=40
+DB_POOL_RECYCLE=1800
+
 # Redis Configuration
 REDIS_URL=redis://redis:6379/0
 
@@ -32,6 +37,7 @@ MS_TENANT=common
 # Email Sync Configuration
 SYNC_INTERVAL_MINUTES=5
 MAX_MESSAGES_PER_ACCOUNT=50
+SYNC_BATCH_SIZE=1000
 
 # JWT Configuration
 JWT_ALGORITHM=HS256